@@ -0,0 +1,82 @@
+# admission.py — per-class concurrency pools so heavy reports can't starve data entry
+#
+# Each request class (write / read / heavy) gets its own concurrency limit and bounded wait queue.
+# When a pool's queue is full the request is rejected (429 + Retry-After) instead of piling up.
+#
+# Env (per class, upper-case name): ADMIT_<CLASS>_CONCURRENCY, ADMIT_<CLASS>_QUEUE, ADMIT_<CLASS>_RETRY_AFTER
+import asyncio, os, time
+from collections import deque
+from typing import Dict, Optional
+
+DEFAULTS = {
+    #          concurrency, queue, retry_after (s)
+    "write": (8,           200,   2),
+    "read":  (8,           100,   2),
+    "heavy": (1,           4,     15),
+}
+
+def _env_int(name: str, default: int) -> int:
+    try: return int(os.getenv(name, default))
+    except ValueError: return default
+
+def _pct(sorted_vals, p: float) -> float:
+    if not sorted_vals: return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(p * len(sorted_vals)))]
+
+class Pool:
+    def __init__(self, name: str, concurrency: int, max_queue: int, retry_after: int):
+        self.name, self.concurrency, self.max_queue, self.retry_after = name, max(1, concurrency), max_queue, retry_after
+        self._sem = asyncio.Semaphore(self.concurrency)
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.max_wait = 0.0
+        self._waits = deque(maxlen=1000)  # seconds, most recent admissions
+
+    async def acquire(self) -> bool:
+        """Wait for a slot; False (rejected) when no slot is free and the queue is already full."""
+        if self._sem.locked() and self.queued >= self.max_queue:
+            self.rejected += 1
+            return False
+        self.queued += 1
+        t0 = time.perf_counter()
+        try:
+            await self._sem.acquire()
+        finally:
+            self.queued -= 1
+        wait = time.perf_counter() - t0
+        self._waits.append(wait)
+        self.max_wait = max(self.max_wait, wait)
+        self.active += 1
+        self.admitted += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+        self._sem.release()
+
+    def stats(self) -> Dict[str, float]:
+        waits = sorted(self._waits)
+        return {
+            "concurrency": self.concurrency, "max_queue": self.max_queue,
+            "active": self.active, "queued": self.queued,
+            "admitted": self.admitted, "rejected": self.rejected,
+            "wait_ms_p50": round(_pct(waits, 0.50) * 1000, 2),
+            "wait_ms_p95": round(_pct(waits, 0.95) * 1000, 2),
+            "wait_ms_max": round(self.max_wait * 1000, 2),
+        }
+
+class Admission:
+    def __init__(self):
+        self.pools: Dict[str, Pool] = {}
+        for name, (conc, queue, retry) in DEFAULTS.items():
+            key = f"ADMIT_{name.upper()}_"
+            self.pools[name] = Pool(name, _env_int(key + "CONCURRENCY", conc), _env_int(key + "QUEUE", queue),
+                                    _env_int(key + "RETRY_AFTER", retry))
+
+    def pool(self, name: Optional[str]) -> Optional[Pool]:
+        return self.pools.get(name) if name else None
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {name: p.stats() for name, p in self.pools.items()}
@@ -0,0 +1,170 @@
+# backup.py — online snapshots of the SQLite DB (sqlite3 backup API) + restore
+#
+#   python backup.py snapshot     # take one snapshot now
+#   python backup.py restore      # restore the newest snapshot over DB_PATH (app must be stopped)
+#   python backup.py list
+#
+# Env: DB_PATH, BACKUP_DIR, BACKUP_KEEP (default 24), BACKUP_TIMEOUT (seconds, default 120),
+#      BACKUP_MAX_TRIES (attempts while the DB is busy/locked, default 20)
+#
+# The copy is one backup step: on the WAL database that is a single read snapshot, so writers are
+# not blocked. Smaller steps let every write from another connection restart the copy from page 0,
+# and on a busy DB the snapshot never finishes.
+import os, sys, gzip, shutil, sqlite3, threading, time
+from datetime import datetime
+from typing import List, Optional
+
+PREFIX, SUFFIX = "maintenance-", ".db.gz"
+SQLITE_DONE = 101  # backup_step result once every page is copied
+
+def _env_int(name: str, default: int) -> int:
+    try: return int(os.getenv(name, default))
+    except ValueError: return default
+
+def _env_float(name: str, default: float) -> float:
+    try: return float(os.getenv(name, default))
+    except ValueError: return default
+
+def list_snapshots(backup_dir: str) -> List[str]:
+    """Snapshot paths, oldest first (names sort by timestamp)."""
+    if not os.path.isdir(backup_dir): return []
+    names = sorted(n for n in os.listdir(backup_dir) if n.startswith(PREFIX) and n.endswith(SUFFIX))
+    return [os.path.join(backup_dir, n) for n in names]
+
+def _db_signature(db_path: str) -> str:
+    """Cheap change marker: size+mtime of the DB and its WAL."""
+    parts = []
+    for p in (db_path, db_path + "-wal"):
+        try:
+            st = os.stat(p); parts.append(f"{st.st_size}:{st.st_mtime_ns}")
+        except FileNotFoundError:
+            parts.append("-")
+    return "|".join(parts)
+
+def snapshot(db_path: str, backup_dir: str, keep: Optional[int] = None,
+             timeout: Optional[float] = None, max_tries: Optional[int] = None) -> str:
+    """Copy the live DB with the backup API in one step, gzip it into backup_dir and prune old
+    snapshots. Returns the snapshot path; raises TimeoutError when the DB stays busy too long."""
+    keep = keep if keep is not None else _env_int("BACKUP_KEEP", 24)
+    timeout = timeout if timeout is not None else _env_float("BACKUP_TIMEOUT", 120)
+    max_tries = max_tries if max_tries is not None else _env_int("BACKUP_MAX_TRIES", 20)
+    os.makedirs(backup_dir, exist_ok=True)
+
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    final = os.path.join(backup_dir, f"{PREFIX}{stamp}{SUFFIX}")
+    raw = final[:-len(".gz")] + ".tmp"
+
+    deadline, tries = time.monotonic() + timeout, 0
+    def guard(status, remaining, total):
+        # called after every backup_step, including the BUSY/LOCKED retries; raising aborts the backup
+        nonlocal tries
+        tries += 1
+        if status != SQLITE_DONE and (tries >= max_tries or time.monotonic() > deadline):
+            raise TimeoutError(f"snapshot aborted after {tries} tries / {timeout:g}s: database busy")
+
+    try:
+        src = sqlite3.connect(db_path, timeout=1)  # per attempt: busy waits stay inside the caps below
+        dst = sqlite3.connect(raw)
+        try:
+            src.backup(dst, pages=-1, progress=guard)
+        finally:
+            dst.close(); src.close()
+
+        with open(raw, "rb") as fi, gzip.open(final + ".tmp", "wb", compresslevel=6) as fo:
+            shutil.copyfileobj(fi, fo, 1024 * 1024)
+        os.replace(final + ".tmp", final)
+    finally:
+        for tmp in (raw, final + ".tmp"):
+            if os.path.exists(tmp): os.remove(tmp)
+
+    if keep > 0:
+        for old in list_snapshots(backup_dir)[:-keep]:
+            try: os.remove(old)
+            except OSError: pass
+    return final
+
+def restore_latest(db_path: str, backup_dir: str) -> Optional[str]:
+    """Restore the newest snapshot that passes quick_check to db_path. Returns the snapshot used."""
+    for snap in reversed(list_snapshots(backup_dir)):
+        tmp = db_path + ".restore"
+        try:
+            with gzip.open(snap, "rb") as fi, open(tmp, "wb") as fo:
+                shutil.copyfileobj(fi, fo, 1024 * 1024)
+            con = sqlite3.connect(tmp)
+            try:
+                ok = con.execute("PRAGMA quick_check").fetchone()[0] == "ok"
+            finally:
+                con.close()
+        except (OSError, EOFError, sqlite3.DatabaseError):
+            ok = False
+        if ok:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            for side in (db_path + "-wal", db_path + "-shm"):
+                if os.path.exists(side): os.remove(side)
+            os.replace(tmp, db_path)
+            return snap
+        if os.path.exists(tmp): os.remove(tmp)
+    return None
+
+class SnapshotScheduler:
+    """Daemon thread taking a snapshot every `interval` seconds, skipped when the DB hasn't changed."""
+
+    def __init__(self, db_path: str, backup_dir: str, interval: float):
+        self.db_path, self.backup_dir, self.interval = db_path, backup_dir, interval
+        self.last_path: Optional[str] = None
+        self.last_error: Optional[str] = None
+        self._last_sig: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def take(self) -> str:
+        """Snapshot now (also on demand); failures and timeouts are kept in last_error and re-raised."""
+        sig = _db_signature(self.db_path)
+        try:
+            self.last_path = snapshot(self.db_path, self.backup_dir)
+        except Exception as e:
+            self.last_error = str(e)
+            raise
+        self._last_sig, self.last_error = sig, None
+        return self.last_path
+
+    def run_once(self) -> Optional[str]:
+        if _db_signature(self.db_path) == self._last_sig:
+            return None
+        try:
+            self.take()
+        except Exception:  # keep the thread alive; surfaced via last_error
+            pass
+        return self.last_path
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="sqlite-snapshots", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+if __name__ == "__main__":
+    db = os.getenv("DB_PATH", os.path.abspath("./maintenance.db"))
+    bdir = os.getenv("BACKUP_DIR", os.path.abspath("./backups"))
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "snapshot"
+    if cmd == "snapshot":
+        print("Snapshot:", snapshot(db, bdir))
+    elif cmd == "restore":
+        if os.path.exists(db) and list_snapshots(bdir):
+            bak = db + "." + time.strftime("%Y%m%d_%H%M%S") + ".bak"
+            os.replace(db, bak)
+            print(f"Current DB backed up to: {bak}")
+        print("Restored from:", restore_latest(db, bdir) or "(no valid snapshot)")
+    elif cmd == "list":
+        for p in list_snapshots(bdir): print(p)
+    else:
+        raise SystemExit("usage: python backup.py [snapshot|restore|list]")
@@ -0,0 +1,389 @@
+# loadtest.py — concurrent load test modelling shop traffic (technicians posting forms, managers on
+# dashboards/finders/exports) against one server
+#
+#   python loadtest.py                               # in-process uvicorn on a fresh temp SQLite DB
+#   python loadtest.py --users 20 --duration 60 --preload 5000 --out run.json
+#   python loadtest.py --url http://127.0.0.1:8000   # an already running server (no preload)
+#   python loadtest.py --compare base.json --out run.json
+#   python loadtest.py --mix post_asset=30,export_month_pack=0
+#
+# Each virtual user keeps one HTTP/1.1 keep-alive connection and loops: pick a route from the weighted
+# mix, send it, think for an exponential --think seconds. Requests in the first --warmup seconds are not
+# counted. A fixed --seed, --duration, --preload and mix give runs that are comparable across commits;
+# the JSON report records the commit and the full configuration.
+#
+# Outcomes per route: ok, error (unexpected status or connection failure), locked (503 / "database is
+# locked") and rejected (429 from admission control: load shed by design, reported apart from errors).
+import argparse, asyncio, json, os, random, socket, subprocess, sys, tempfile, threading, time, uuid
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+MIX = {
+    # technicians
+    "post_asset": 20, "post_spare": 15, "post_issue": 15, "post_cabinet": 10,
+    # dashboard refresh / lookups
+    "stats_cabinets": 8, "stats_assets": 8, "stats_spares": 8,
+    "find_cabinet": 4, "find_asset": 4, "find_spare": 4,
+    # reports
+    "export_assets": 1, "export_monthly_summary": 1, "export_month_pack": 0.5,
+}
+
+CATEGORIES = {  # used when /api/categories is unreachable
+    "cab": ["ATS", "AMF", "HYBRID"], "ast": ["بطاريات", "مولدات"], "spa": ["سلف", "دينمو شحن"],
+}
+PEOPLE = ["أحمد", "محمد علي", "خالد", "سالم", "عبدالله", "ناصر"]
+PLACES = ["صنعاء", "عدن", "تعز", "المخزن الرئيسي", "الحديدة"]
+
+# ---------------- minimal async HTTP/1.1 client (keep-alive, Content-Length/chunked) ----------------
+class Conn:
+    def __init__(self, host: str, port: int):
+        self.host, self.port = host, port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def close(self):
+        if self.writer:
+            self.writer.close()
+            try: await self.writer.wait_closed()
+            except OSError: pass
+        self.reader = self.writer = None
+
+    async def request(self, method: str, path: str, body: bytes = b"",
+                      headers: Optional[Dict[str, str]] = None) -> Tuple[int, Dict[str, str], bytes]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}", f"Content-Length: {len(body)}"]
+        lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+        try:
+            head = await self.reader.readuntil(b"\r\n\r\n")
+            status_line, *header_lines = head.decode("latin-1").split("\r\n")
+            status = int(status_line.split()[1])
+            hdrs = {}
+            for h in header_lines:
+                if ":" in h:
+                    k, v = h.split(":", 1)
+                    hdrs[k.strip().lower()] = v.strip()
+            if "content-length" in hdrs:
+                data = await self.reader.readexactly(int(hdrs["content-length"]))
+            elif hdrs.get("transfer-encoding", "").lower() == "chunked":
+                parts = []
+                while True:
+                    size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                    chunk = await self.reader.readexactly(size + 2)
+                    if size == 0: break
+                    parts.append(chunk[:-2])
+                data = b"".join(parts)
+            else:
+                data = await self.reader.read()
+                await self.close()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            await self.close(); raise
+        if hdrs.get("connection", "").lower() == "close":
+            await self.close()
+        return status, hdrs, data
+
+# ------------------------------------ traffic ------------------------------------
+class Traffic:
+    """Builds requests for each route; remembers created codes/serials so finders mostly hit."""
+
+    def __init__(self, categories: Dict[str, List[str]], day: date):
+        self.cat = categories
+        self.day = day
+        self.codes: List[str] = []
+        self.asset_serials: List[str] = []
+        self.spare_serials: List[str] = []
+
+    def _date(self, rng: random.Random) -> str:
+        return (self.day - timedelta(days=rng.randint(0, self.day.day - 1))).isoformat()
+
+    def _known(self, rng: random.Random, pool: List[str]) -> str:
+        return rng.choice(pool) if pool and rng.random() < 0.8 else f"MISSING-{rng.randint(1, 10**6)}"
+
+    def build(self, route: str, rng: random.Random) -> Tuple[str, str, Dict[str, Any]]:
+        """(method, path, form) for a route."""
+        y, m = self.day.year, self.day.month
+        if route == "post_asset":
+            sn = f"LT-A-{uuid.uuid4().hex[:12]}"; self.asset_serials.append(sn)
+            return "POST", "/api/assets", {
+                "asset_type": rng.choice(self.cat["ast"]), "model": rng.choice(["CAT 3306", "Perkins", "Volvo"]),
+                "serial_or_code": sn, "quantity": rng.randint(1, 3), "prev_location": rng.choice(PLACES),
+                "supply_date": self._date(rng), "rehab_date": self._date(rng), "qualified_by": rng.choice(PEOPLE),
+                "inspector": rng.choice(PEOPLE), "tested": "true", "receiver": rng.choice(PEOPLE)}
+        if route == "post_spare":
+            sn = f"LT-S-{uuid.uuid4().hex[:12]}"; self.spare_serials.append(sn)
+            return "POST", "/api/spares", {
+                "part_category": rng.choice(self.cat["spa"]), "part_name": "قطعة", "quantity": rng.randint(1, 4),
+                "serial": sn, "source": rng.choice(PLACES), "qualified_by": rng.choice(PEOPLE),
+                "rehab_date": self._date(rng)}
+        if route == "post_issue":
+            return "POST", "/api/issue", {
+                "item_name": "بطارية", "model": "N200", "quantity": 1, "location": rng.choice(PLACES),
+                "requester": rng.choice(PEOPLE), "issue_date": self._date(rng), "receiver": rng.choice(PEOPLE)}
+        if route == "post_cabinet":
+            code = f"LT-C-{uuid.uuid4().hex[:12]}"; self.codes.append(code)
+            return "POST", "/api/cabinets", {
+                "cabinet_type": rng.choice(self.cat["cab"]), "code": code, "rehab_date": self._date(rng),
+                "qualified_by": rng.choice(PEOPLE), "location": rng.choice(PLACES)}
+        if route.startswith("stats_"):
+            q = {"year": y, "month": m}
+            if route == "stats_assets": q["date_field"] = "rehab_date"
+            return "GET", f"/api/stats/{route[6:]}?{urlencode(q)}", {}
+        if route == "find_cabinet":
+            return "GET", "/api/cabinets/find?" + urlencode({"code": self._known(rng, self.codes)}), {}
+        if route == "find_asset":
+            return "GET", "/api/assets/find?" + urlencode({"serial": self._known(rng, self.asset_serials)}), {}
+        if route == "find_spare":
+            return "GET", "/api/spares/find?" + urlencode({"serial": self._known(rng, self.spare_serials)}), {}
+        if route.startswith("export_"):
+            return "GET", f"/api/export/{route[7:]}.xlsx?year={y}&month={m}", {}
+        raise ValueError(f"unknown route: {route}")
+
+def ok_statuses(route: str) -> Tuple[int, ...]:
+    return (200, 404) if route.startswith("find_") else (200,)
+
+# ------------------------------------ stats ------------------------------------
+def pct(sorted_vals: List[float], p: float) -> float:
+    if not sorted_vals: return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(p * len(sorted_vals)))]
+
+class RouteStats:
+    def __init__(self):
+        self.lat: List[float] = []  # seconds, all counted requests
+        self.ok = self.error = self.locked = self.rejected = 0
+        self.statuses: Dict[str, int] = {}
+
+    def record(self, route: str, dt: float, status: Optional[int], body: bytes):
+        self.lat.append(dt)
+        key = str(status) if status is not None else "conn"
+        self.statuses[key] = self.statuses.get(key, 0) + 1
+        if status in ok_statuses(route): self.ok += 1
+        elif status == 429: self.rejected += 1
+        elif status == 503 or b"database is locked" in body: self.locked += 1
+        else: self.error += 1
+
+    def summary(self, seconds: float) -> Dict[str, Any]:
+        lat = sorted(self.lat); n = len(lat)
+        ms = lambda v: round(v * 1000, 1)
+        rate = lambda k: round(100.0 * k / n, 2) if n else 0.0
+        return {"n": n, "rps": round(n / seconds, 2) if seconds else 0.0,
+                "p50_ms": ms(pct(lat, 0.50)), "p95_ms": ms(pct(lat, 0.95)), "p99_ms": ms(pct(lat, 0.99)),
+                "max_ms": ms(lat[-1]) if lat else 0.0,
+                "error_pct": rate(self.error), "locked_pct": rate(self.locked), "rejected_pct": rate(self.rejected),
+                "statuses": dict(sorted(self.statuses.items()))}
+
+# ------------------------------------ runner ------------------------------------
+async def virtual_user(uid: int, host: str, port: int, traffic: Traffic, routes: List[str], weights: List[float],
+                       args, t_count: float, t_end: float, stats: Dict[str, RouteStats]):
+    rng = random.Random(args.seed * 1000 + uid)
+    conn = Conn(host, port)
+    await asyncio.sleep(rng.random() * min(1.0, args.think or 0.1))  # don't start in lockstep
+    try:
+        while time.perf_counter() < t_end:
+            route = rng.choices(routes, weights)[0]
+            method, path, form = traffic.build(route, rng)
+            body = urlencode(form).encode() if method == "POST" else b""
+            headers = {"Content-Type": "application/x-www-form-urlencoded",
+                       "Idempotency-Key": uuid.uuid4().hex} if method == "POST" else {}
+            t0 = time.perf_counter()
+            try:
+                status, _, data = await asyncio.wait_for(conn.request(method, path, body, headers), args.timeout)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                await conn.close()
+                status, data = None, b""
+            dt = time.perf_counter() - t0
+            if t0 >= t_count:
+                stats.setdefault(route, RouteStats()).record(route, dt, status, data)
+            if args.think > 0:
+                await asyncio.sleep(rng.expovariate(1.0 / args.think))
+    finally:
+        await conn.close()
+
+async def fetch_categories(host: str, port: int) -> Dict[str, List[str]]:
+    conn = Conn(host, port)
+    try:
+        status, _, data = await conn.request("GET", "/api/categories")
+        cats = json.loads(data) if status == 200 else {}
+        return {k: (cats.get(k) or v) for k, v in CATEGORIES.items()}
+    except (OSError, ValueError):
+        return CATEGORIES
+    finally:
+        await conn.close()
+
+async def run(host: str, port: int, args, mix: Dict[str, float]) -> Dict[str, Any]:
+    routes = [r for r, w in mix.items() if w > 0]
+    weights = [mix[r] for r in routes]
+    traffic = Traffic(await fetch_categories(host, port), date.today())
+    stats: Dict[str, RouteStats] = {}
+    start = time.perf_counter()
+    t_count, t_end = start + args.warmup, start + args.warmup + args.duration
+    await asyncio.gather(*[virtual_user(i, host, port, traffic, routes, weights, args, t_count, t_end, stats)
+                           for i in range(args.users)])
+    # requests still in flight at t_end finish after it; measure over the real counted window
+    counted = max(time.perf_counter(), t_end) - t_count
+    total = RouteStats()
+    for route, s in stats.items():
+        total.lat += s.lat
+        total.ok += s.ok; total.error += s.error; total.locked += s.locked; total.rejected += s.rejected
+        for k, v in s.statuses.items(): total.statuses[k] = total.statuses.get(k, 0) + v
+    return {"seconds": round(counted, 2), "total": total.summary(counted),
+            "routes": {r: stats[r].summary(counted) for r in routes if r in stats}}
+
+# ------------------------------- in-process server -------------------------------
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def preload(main, n: int, seed: int):
+    """n rows per table over the current and previous two months, straight through the app's engine."""
+    from sqlalchemy import insert
+    rng = random.Random(seed)
+    today = date.today()
+    day = lambda: today - timedelta(days=rng.randint(0, 90))
+    cats = {k: [name for _, name in rows] for k, rows in main._categories()["by_kind"].items()}
+    pick = lambda kind: (lambda name: (name, main.category_id(kind, name)))(rng.choice(cats[kind]))
+    with main.engine.begin() as conn:
+        conn.execute(insert(main.CabinetRehab.__table__), [
+            dict(zip(("cabinet_type", "cabinet_type_id"), pick("cab")), code=f"PL-C-{i}", rehab_date=day(),
+                 location=rng.choice(PLACES), qualified_by=rng.choice(PEOPLE)) for i in range(n)])
+        conn.execute(insert(main.AssetRehab.__table__), [
+            dict(zip(("asset_type", "asset_type_id"), pick("ast")), serial_or_code=f"PL-A-{i}",
+                 quantity=rng.randint(1, 3), supply_date=day(), rehab_date=rng.choice([None, day()]),
+                 prev_location=rng.choice(PLACES), qualified_by=rng.choice(PEOPLE)) for i in range(n)])
+        conn.execute(insert(main.SparePartRehab.__table__), [
+            dict(zip(("part_category", "part_category_id"), pick("spa")), part_name="قطعة", serial=f"PL-S-{i}",
+                 quantity=rng.randint(1, 4), rehab_date=day(), qualified_by=rng.choice(PEOPLE)) for i in range(n)])
+        conn.execute(insert(main.Issue.__table__), [
+            dict(item_name="بطارية", quantity=1, issue_date=day(), location=rng.choice(PLACES),
+                 receiver=rng.choice(PEOPLE)) for i in range(n)])
+
+def start_server(args) -> Tuple[Any, threading.Thread, int]:
+    """Import the app on a fresh DB (DB_PATH=--db or a temp file), preload it and serve it from a thread."""
+    import uvicorn
+    if not args.db:
+        args.db = os.path.join(tempfile.mkdtemp(prefix="loadtest-"), "maintenance.db")
+    os.environ["DB_PATH"] = args.db = os.path.abspath(args.db)
+    os.environ.pop("DATABASE_URL", None)
+    os.environ.pop("BACKUP_DIR", None)
+    here = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(here)  # static/ and relative paths, as under `uvicorn main:app`
+    sys.path.insert(0, here)
+    import main
+    if args.preload: preload(main, args.preload, args.seed)
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning",
+                                           access_log=False, lifespan="on"))
+    thread = threading.Thread(target=server.run, name="uvicorn", daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive(): raise SystemExit("server failed to start")
+        time.sleep(0.05)
+    return server, thread, port
+
+# ------------------------------------ report ------------------------------------
+COLS = [("n", 7), ("rps", 8), ("p50_ms", 8), ("p95_ms", 8), ("p99_ms", 8), ("max_ms", 8),
+        ("error_pct", 7), ("locked_pct", 8), ("rejected_pct", 8)]
+HEADS = ["n", "req/s", "p50", "p95", "p99", "max", "err%", "locked%", "429%"]
+
+def print_report(rep: Dict[str, Any]):
+    cfg = rep["config"]
+    print(f"\ncommit {rep['commit']}{' (dirty)' if rep['dirty'] else ''}  target {cfg['target']}  "
+          f"users {cfg['users']}  {rep['seconds']}s counted  think {cfg['think']}s  preload {cfg['preload']}")
+    print(f"{'route':24}" + "".join(f"{h:>{w}}" for h, (_, w) in zip(HEADS, COLS)) + "   (ms)")
+    for name, s in list(rep["routes"].items()) + [("TOTAL", rep["total"])]:
+        print(f"{name:24}" + "".join(f"{s[k]:>{w}}" for k, w in COLS))
+    odd = {r: s["statuses"] for r, s in rep["routes"].items() if set(s["statuses"]) - {"200", "404"}}
+    for r, st in odd.items():
+        print(f"  {r}: statuses {st}")
+
+def print_compare(base: Dict[str, Any], rep: Dict[str, Any]):
+    print(f"\nvs {base['commit']}{' (dirty)' if base['dirty'] else ''}  (new - base)")
+    if base["config"] != rep["config"]:
+        diff = {k: (base["config"].get(k), v) for k, v in rep["config"].items()
+                if k != "mix" and base["config"].get(k) != v}
+        old_mix = base["config"].get("mix", {})
+        diff.update({f"mix.{r}": (old_mix.get(r), w) for r, w in rep["config"]["mix"].items() if old_mix.get(r) != w})
+        print(f"  WARNING: configurations differ: {diff}")
+    keys = ["rps", "p50_ms", "p95_ms", "p99_ms", "error_pct", "locked_pct"]
+    print(f"{'route':24}" + "".join(f"{k:>18}" for k in keys))
+    for name in list(rep["routes"]) + ["TOTAL"]:
+        new = rep["total"] if name == "TOTAL" else rep["routes"][name]
+        old = base["total"] if name == "TOTAL" else base["routes"].get(name)
+        if not old: continue
+        cells = []
+        for k in keys:
+            d = new[k] - old[k]
+            rel = f"{100.0 * d / old[k]:+.0f}%" if old[k] else ""
+            cells.append(f"{d:+.1f} {rel}".rstrip())
+        print(f"{name:24}" + "".join(f"{c:>18}" for c in cells))
+
+def git_commit() -> Tuple[str, bool]:
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        head = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here, capture_output=True,
+                              text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=here,
+                                    capture_output=True, text=True).stdout.strip())
+        return head, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+
+def parse_mix(spec: Optional[str]) -> Dict[str, float]:
+    mix = dict(MIX)
+    for part in filter(None, (spec or "").split(",")):
+        name, _, w = part.partition("=")
+        if name.strip() not in MIX: raise SystemExit(f"unknown route in --mix: {name} (known: {', '.join(MIX)})")
+        mix[name.strip()] = float(w)
+    return mix
+
+def main_cli():
+    ap = argparse.ArgumentParser(description="Concurrent load test for the maintenance app")
+    ap.add_argument("--url", help="target a running server (default: in-process uvicorn on a temp DB)")
+    ap.add_argument("--db", help="SQLite file for the in-process server (default: fresh temp file)")
+    ap.add_argument("--preload", type=int, default=2000, help="rows per table before the run (in-process only)")
+    ap.add_argument("--users", type=int, default=25, help="concurrent virtual users")
+    ap.add_argument("--duration", type=float, default=30, help="counted seconds")
+    ap.add_argument("--warmup", type=float, default=3, help="uncounted seconds at the start")
+    ap.add_argument("--think", type=float, default=0.2, help="mean think time between requests, seconds")
+    ap.add_argument("--timeout", type=float, default=60, help="per-request timeout, seconds")
+    ap.add_argument("--mix", help="route weights, e.g. post_asset=30,export_month_pack=0")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", help="write the JSON report here")
+    ap.add_argument("--compare", help="baseline JSON report to diff against")
+    args = ap.parse_args()
+    mix = parse_mix(args.mix)
+
+    server = thread = None
+    if args.url:
+        u = urlsplit(args.url)
+        host, port, target = u.hostname or "127.0.0.1", u.port or 80, args.url
+        args.preload = 0
+    else:
+        server, thread, port = start_server(args)
+        host, target = "127.0.0.1", "in-process"
+    try:
+        result = asyncio.run(run(host, port, args, mix))
+    finally:
+        if server:
+            server.should_exit = True
+            thread.join(timeout=10)
+
+    commit, dirty = git_commit()
+    rep = {"commit": commit, "dirty": dirty, "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+           "python": sys.version.split()[0],
+           "config": {"target": target, "users": args.users, "duration": args.duration, "warmup": args.warmup,
+                      "think": args.think, "preload": args.preload, "seed": args.seed, "mix": mix},
+           **result}
+    print_report(rep)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_compare(json.load(f), rep)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(rep, f, ensure_ascii=False, indent=2)
+        print(f"\nreport: {args.out}")
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,21 +1,31 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
-import os, io
-from datetime import date, datetime
+import os, io, csv, time, hmac, logging
+from datetime import date, datetime, timedelta
 from typing import Optional, Tuple, List, Dict, Any
 
-from fastapi import FastAPI, HTTPException, Request, Query
+from fastapi import FastAPI, HTTPException, Request, Query, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
 
 from sqlmodel import SQLModel, Field, Session, select, create_engine
-from sqlalchemy import func, text
-from sqlalchemy.exc import ProgrammingError, OperationalError
+from sqlalchemy import func, text, Index, UniqueConstraint, MetaData, Table, Column, insert, delete, union_all
+from sqlalchemy import update, literal, cast, or_, event
+from sqlalchemy import select as sa_select  # Core selects over archive tables (sqlmodel.select scalarizes a lone Table)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import ProgrammingError, OperationalError, IntegrityError
+from sqlalchemy.schema import CreateIndex, CreateTable
 
 from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill, Border, Side, NamedStyle
+from openpyxl.styles.fonts import DEFAULT_FONT
+
+import admission, backup, pg, slowlog, suggest
 
 # ===================== DB =====================
 def _normalize_database_url(url: str) -> str:
@@ -26,13 +36,18 @@ def _normalize_database_url(url: str) -> str:
     return url
 
 DATABASE_URL = (os.getenv("DATABASE_URL") or "").strip()
+# نسخ احتياطي (SQLite فقط): BACKUP_DIR يفعّل اللقطات الدورية، ويُستعاد منه آخر نسخة إن كان ملف القاعدة مفقودًا
+BACKUP_DIR = (os.getenv("BACKUP_DIR") or "").strip()
+RESTORED_FROM: Optional[str] = None
 if DATABASE_URL:
     DATABASE_URL = _normalize_database_url(DATABASE_URL)
-    engine = create_engine(DATABASE_URL, pool_pre_ping=True, echo=False)
+    engine = create_engine(DATABASE_URL, **pg.engine_kwargs())
     DIALECT = "postgres"
 else:
     DB_PATH = os.getenv("DB_PATH", "./maintenance.db")
     os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+    if BACKUP_DIR and not os.path.exists(DB_PATH):
+        RESTORED_FROM = backup.restore_latest(DB_PATH, BACKUP_DIR)
     engine = create_engine(
         f"sqlite:///{DB_PATH}",
         connect_args={"check_same_thread": False},
@@ -41,8 +56,25 @@ else:
     )
     DIALECT = "sqlite"
 
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _):
+        # WAL: readers (exports) no longer block writers; busy_timeout: writers wait for the lock instead of failing
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute(f"PRAGMA busy_timeout={int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))}")
+        cur.close()
+
+# statements slower than SLOW_QUERY_MS, with route and plan -> /api/debug/slow_queries
+slow_queries = slowlog.SlowQueryLog()
+slow_queries.install(engine)
+# the log holds raw bound parameters (names, serials, stored responses): its endpoints exist only when
+# SLOW_QUERY_ADMIN_TOKEN is set and answer only requests sending it in X-Admin-Token
+SLOW_QUERY_ADMIN_TOKEN = (os.getenv("SLOW_QUERY_ADMIN_TOKEN") or "").strip()
+
 # =================== Models ===================
 class Issue(SQLModel, table=True):
+    __table_args__ = {"sqlite_autoincrement": True}  # archived ids are never handed out again
     id: Optional[int] = Field(default=None, primary_key=True)
     item_name: str
     model: Optional[str] = None
@@ -51,15 +83,32 @@ class Issue(SQLModel, table=True):
     quantity: int = 1
     location: Optional[str] = None
     requester: Optional[str] = None
-    issue_date: date
+    issue_date: date = Field(index=True)
     qualified_by: Optional[str] = None
     receiver: Optional[str] = None
 
+class Category(SQLModel, table=True):
+    """جدول الأصناف: kind = cab | ast | spa. report_label للسطر المقابل في الملخص الشهري/الربعي."""
+    __table_args__ = (UniqueConstraint("kind", "name", name="uq_category_kind_name"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str = Field(index=True)
+    name: str
+    position: int = 0
+    report_label: Optional[str] = None
+    report_position: Optional[int] = None
+
 class CabinetRehab(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_cabinetrehab_cabinet_type_id_rehab_date", "cabinet_type_id", "rehab_date"),
+        Index("ux_cabinetrehab_code", "code", unique=True,
+              sqlite_where=text("code IS NOT NULL"), postgresql_where=text("code IS NOT NULL")),
+        {"sqlite_autoincrement": True},
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     cabinet_type: str
+    cabinet_type_id: Optional[int] = Field(default=None, foreign_key="category.id")
     code: Optional[str] = Field(default=None, index=True)
-    rehab_date: date
+    rehab_date: date = Field(index=True)
     qualified_by: Optional[str] = None
     location: Optional[str] = None
     receiver: Optional[str] = None
@@ -67,8 +116,16 @@ class CabinetRehab(SQLModel, table=True):
     notes: Optional[str] = None
 
 class AssetRehab(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_assetrehab_asset_type_id_rehab_date", "asset_type_id", "rehab_date"),
+        Index("ux_assetrehab_serial_or_code", "serial_or_code", unique=True,
+              sqlite_where=text("serial_or_code IS NOT NULL"), postgresql_where=text("serial_or_code IS NOT NULL")),
+        Index("ix_assetrehab_effective_date", text("COALESCE(rehab_date, supply_date)")),  # ARCHIVE_DATE
+        {"sqlite_autoincrement": True},
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     asset_type: str
+    asset_type_id: Optional[int] = Field(default=None, foreign_key="category.id")
     model: Optional[str] = None
     serial_or_code: Optional[str] = Field(default=None, index=True)
     quantity: int = 1
@@ -86,18 +143,39 @@ class AssetRehab(SQLModel, table=True):
     rehab_date: Optional[date] = Field(default=None, index=True)  # مهم للتقارير والرسوم
 
 class SparePartRehab(SQLModel, table=True):
+    __table_args__ = (Index("ix_sparepartrehab_part_category_id_rehab_date", "part_category_id", "rehab_date"),
+                      {"sqlite_autoincrement": True})
     id: Optional[int] = Field(default=None, primary_key=True)
     part_category: str
+    part_category_id: Optional[int] = Field(default=None, foreign_key="category.id")
     part_name: Optional[str] = None
     part_model: Optional[str] = None
     quantity: int = 1
     serial: Optional[str] = Field(default=None, index=True)
     source: Optional[str] = None
     qualified_by: Optional[str] = None
-    rehab_date: date
+    rehab_date: date = Field(index=True)
     tested: Optional[bool] = None
     notes: Optional[str] = None
 
+class ArchiveYear(SQLModel, table=True):
+    """سجل الأرشفة: جدول <table_name>_<year> يحوي سجلات تلك السنة المنقولة من الجدول الأساسي."""
+    __table_args__ = (UniqueConstraint("table_name", "year", name="uq_archiveyear_table_year"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    table_name: str
+    year: int
+    rows: int = 0
+    archived_at: datetime = Field(default_factory=datetime.utcnow)
+
+class IdempotencyKey(SQLModel, table=True):
+    """استجابة محفوظة لطلب POST حسب ترويسة Idempotency-Key (status = 0 أثناء المعالجة)."""
+    key: str = Field(primary_key=True)
+    path: str
+    status: int = 0
+    content_type: Optional[str] = None
+    body: Optional[bytes] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
 def init_db():
     SQLModel.metadata.create_all(engine)
 init_db()
@@ -135,6 +213,399 @@ def _ensure_asset_rehab_date():
 
 _ensure_asset_rehab_date()
 
+# --------- Categories: lookup table + integer keys on rehab tables ----------
+CATEGORY_SEED: Dict[str, List[str]] = {
+    "cab": ["ATS","AMF","HYBRID","حماية انفرتر","ظفيرة تحكم"],
+    "ast": ["بطاريات","موحدات","محركات","مولدات","مكيفات","أصول أخرى"],
+    "spa": ["مضخات الديزل","النوزلات","سلف","دينمو شحن","كروت وشواحن","موديولات","منظمات وانفرترات","تسييخ","أخرى"],
+}
+
+# ترتيب وأسماء أسطر الملخص الشهري/الربعي (تُزرع في جدول category مرة واحدة)
+REPORT_SEED: List[Tuple[str, Tuple[str, str]]] = [
+    ("تجميع كبائن تحكم ATS",         ("cab", "ATS")),
+    ("تجميع كبائن تحكم ATS HYBRID",  ("cab", "HYBRID")),
+    ("تجميع كبائن تحكم AMF",         ("cab", "AMF")),
+    ("تجميع ظفائر مولدات",           ("cab", "ظفيرة تحكم")),
+    ("تأهيل موحدات",                  ("ast", "موحدات")),
+    ("تأهيل بطاريات",                 ("ast", "بطاريات")),
+    ("تأهيل محركات",                  ("ast", "محركات")),
+    ("تأهيل مولدات",                  ("ast", "مولدات")),
+    ("تأهيل مكيفات",                  ("ast", "مكيفات")),
+    ("تأهيل أصول أخرى",               ("ast", "أصول أخرى")),
+    ("إصلاح موديولات",                ("spa", "موديولات")),
+    ("إصلاح دينمو شحن",               ("spa", "دينمو شحن")),
+    ("إصلاح سلف مولد",                ("spa", "سلف")),
+    ("إصلاح منظمات شمسية وإنفرترات", ("spa", "منظمات وانفرترات")),
+    ("إصلاح كروت وشواحن",            ("spa", "كروت وشواحن")),
+    ("إصلاح قطع غيار أخرى",           ("spa", "أخرى")),
+]
+
+# kind -> (table, text column, id column)
+CATEGORY_COLUMNS: Dict[str, Tuple[str, str, str]] = {
+    "cab": ("cabinetrehab",   "cabinet_type",  "cabinet_type_id"),
+    "ast": ("assetrehab",     "asset_type",    "asset_type_id"),
+    "spa": ("sparepartrehab", "part_category", "part_category_id"),
+}
+
+def _has_col(conn, table: str, col: str) -> bool:
+    if DIALECT == "sqlite":
+        rows = conn.execute(text(f"PRAGMA table_info('{table}')")).fetchall()
+        return any(r[1] == col for r in rows)
+    return conn.execute(text(
+        "SELECT 1 FROM information_schema.columns WHERE table_name=:t AND column_name=:c"
+    ), {"t": table, "c": col}).fetchone() is not None
+
+def _ensure_categories():
+    """Seed the category table, add *_id columns to old DBs and backfill them from the text columns."""
+    report = {key: (label, pos) for pos, (label, key) in enumerate(REPORT_SEED, start=1)}
+    with Session(engine) as s:
+        existing = {(c.kind, c.name) for c in s.exec(select(Category)).all()}
+        for kind, names in CATEGORY_SEED.items():
+            for pos, name in enumerate(names, start=1):
+                if (kind, name) in existing: continue
+                label, rpos = report.get((kind, name), (None, None))
+                s.add(Category(kind=kind, name=name, position=pos, report_label=label, report_position=rpos))
+        s.commit()
+
+    with engine.begin() as conn:
+        for kind, (table, text_col, id_col) in CATEGORY_COLUMNS.items():
+            if not _has_col(conn, table, id_col):
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {id_col} INTEGER REFERENCES category (id);"))
+            conn.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_{table}_{id_col}_rehab_date ON {table} ({id_col}, rehab_date);"
+            ))
+        _backfill_category_ids(conn)
+    _category_cache.clear()
+
+def _backfill_category_ids(conn, only: Optional[str] = None):
+    """Fill NULL *_id columns from the category text (after migrations and bulk loads)."""
+    for kind, (table, text_col, id_col) in CATEGORY_COLUMNS.items():
+        if only and table != only: continue
+        conn.execute(text(
+            f"UPDATE {table} SET {id_col} = (SELECT c.id FROM category c "
+            f"WHERE c.kind = :kind AND c.name = TRIM({table}.{text_col})) "
+            f"WHERE {id_col} IS NULL"
+        ), {"kind": kind})
+
+_category_cache: Dict[str, Any] = {}
+
+def _categories() -> Dict[str, Any]:
+    """Category lookups, loaded once per process (cleared by _ensure_categories)."""
+    if not _category_cache:
+        with Session(engine) as s:
+            rows = s.exec(select(Category).order_by(Category.kind, Category.position, Category.id)).all()
+        by_kind: Dict[str, List[Tuple[int, str]]] = {k: [] for k in CATEGORY_SEED}
+        ids: Dict[Tuple[str, str], int] = {}
+        report: List[Tuple[int, str, int]] = []
+        for c in rows:
+            by_kind.setdefault(c.kind, []).append((c.id, c.name))
+            ids[(c.kind, c.name)] = c.id
+            if c.report_label:
+                report.append((c.report_position or 0, c.report_label, c.id))
+        _category_cache.update(
+            by_kind=by_kind,
+            ids=ids,
+            report_rows=[(label, cid) for _, label, cid in sorted(report)],
+        )
+    return _category_cache
+
+def category_id(kind: str, name: Optional[str]) -> int:
+    cid = _categories()["ids"].get((kind, norm(name) or ""))
+    if cid is None:
+        raise HTTPException(400, f"صنف غير معروف: {name or ''}")
+    return cid
+
+def report_rows() -> List[Tuple[str, int]]:
+    """[(label, category_id)] in the order of the monthly/quarterly summaries."""
+    return _categories()["report_rows"]
+
+_ensure_categories()
+
+# --------- Archive: closed years moved to <table>_<year> ----------
+ARCHIVED_MODELS = [Issue, CabinetRehab, AssetRehab, SparePartRehab]
+
+# التاريخ الذي تُحدَّد به سنة السجل عند الأرشفة
+ARCHIVE_DATE = {
+    "issue":          lambda t: t.c.issue_date,
+    "cabinetrehab":   lambda t: t.c.rehab_date,
+    "assetrehab":     lambda t: func.coalesce(t.c.rehab_date, t.c.supply_date),
+    "sparepartrehab": lambda t: t.c.rehab_date,
+}
+
+# أعمدة البحث المفهرسة في جداول الأرشيف (find_* وفحص التكرار)
+ARCHIVE_LOOKUP_COLS = {
+    "issue": [], "cabinetrehab": ["code"], "assetrehab": ["serial_or_code"], "sparepartrehab": ["serial"],
+}
+
+archive_metadata = MetaData()
+# archiveyear is cached per process; other workers archive too, so the cache is checked against the table's
+# (row count, newest archived_at) at most every ARCHIVE_CACHE_TTL seconds and re-read when that changes
+ARCHIVE_CACHE_TTL = float(os.getenv("ARCHIVE_CACHE_TTL", "1"))
+_archive_cache: Dict[str, List[int]] = {}
+_archive_marker: Optional[Tuple[Any, ...]] = None
+_archive_checked_at = 0.0
+
+def _archive_table(model, year: int) -> Table:
+    base = model.__table__
+    name = f"{base.name}_{year}"
+    if name in archive_metadata.tables:
+        return archive_metadata.tables[name]
+    t = Table(name, archive_metadata,
+              *[Column(c.name, c.type, primary_key=c.primary_key, autoincrement=False) for c in base.columns])
+    date_cols = ["rehab_date"] if "rehab_date" in base.c else ["issue_date"]
+    for col in date_cols + ARCHIVE_LOOKUP_COLS[base.name]:
+        Index(f"ix_{name}_{col}", t.c[col])
+    if base.name == "assetrehab":
+        Index(f"ix_{name}_effective_date", ARCHIVE_DATE["assetrehab"](t))
+    return t
+
+def archived_years(model) -> List[int]:
+    """Archived years for a table, ascending (cached, see ARCHIVE_CACHE_TTL; reset by archive_year)."""
+    global _archive_cache, _archive_marker, _archive_checked_at
+    now = time.monotonic()
+    if _archive_marker is None or now - _archive_checked_at > ARCHIVE_CACHE_TTL:
+        a = ArchiveYear.__table__
+        with engine.connect() as conn:
+            marker = tuple(conn.execute(sa_select(func.count(), func.max(a.c.archived_at))).one())
+            if marker != _archive_marker:
+                years: Dict[str, List[int]] = {}
+                for name, year in conn.execute(sa_select(a.c.table_name, a.c.year).order_by(a.c.year)):
+                    years.setdefault(name, []).append(year)
+                _archive_cache, _archive_marker = years, marker  # swapped whole: readers never see it half-filled
+        _archive_checked_at = now
+    return _archive_cache.get(model.__table__.name, [])
+
+def partitions(model, start: Optional[date] = None, end: Optional[date] = None) -> List[Table]:
+    """Archive tables whose year overlaps [start, end) (None = open), oldest first, then the live table."""
+    out = [_archive_table(model, y) for y in archived_years(model)
+           if (start is None or y >= start.year) and (end is None or date(y, 1, 1) < end)]
+    return out + [model.__table__]
+
+def archive_year(year: int) -> Dict[str, int]:
+    """Move every row dated in `year` from the live tables into <table>_<year>, in one transaction."""
+    global _archive_marker
+    start, end = date(year, 1, 1), date(year + 1, 1, 1)
+    moved: Dict[str, int] = {}
+    with engine.begin() as conn:
+        for model in ARCHIVED_MODELS:
+            base = model.__table__
+            arch = _archive_table(model, year)
+            arch.create(conn, checkfirst=True)
+            for ix in arch.indexes:  # IF NOT EXISTS: checkfirst can't reflect expression indexes
+                conn.execute(CreateIndex(ix, if_not_exists=True))
+            if DIALECT == "postgres":  # whole-month counts match date_trunc on archives too
+                pg.ensure_month_indexes(conn, base.name, arch.name)
+            d = ARCHIVE_DATE[base.name](base)
+            in_year = (d >= start) & (d < end)
+            cols = [c.name for c in base.columns]
+            # ids reused before AUTOINCREMENT (or a re-archived year) may already be in the archive:
+            # give those live rows fresh ids instead of failing on the archive's primary key
+            clashes = conn.execute(sa_select(base).where(in_year, base.c.id.in_(sa_select(arch.c.id)))).mappings().all()
+            if clashes:
+                conn.execute(delete(base).where(base.c.id.in_([r["id"] for r in clashes])))
+                conn.execute(insert(base), [{c: r[c] for c in cols if c != "id"} for r in clashes])
+            conn.execute(insert(arch).from_select(cols, sa_select(*[base.c[c] for c in cols]).where(in_year)))
+            n = conn.execute(delete(base).where(in_year)).rowcount or 0
+            moved[base.name] = n
+            rec = conn.execute(sa_select(ArchiveYear.id, ArchiveYear.rows).where(
+                ArchiveYear.table_name == base.name, ArchiveYear.year == year)).first()
+            if rec:
+                conn.execute(ArchiveYear.__table__.update().where(ArchiveYear.id == rec[0])
+                             .values(rows=rec[1] + n, archived_at=datetime.utcnow()))
+            else:
+                conn.execute(insert(ArchiveYear).values(table_name=base.name, year=year, rows=n,
+                                                        archived_at=datetime.utcnow()))
+    _archive_marker = None  # re-read on the next archived_years()
+    return moved
+
+# --------- Ids: SQLite tables made before AUTOINCREMENT reuse archived ids ----------
+def _ensure_autoincrement():
+    """Rebuild archived SQLite tables without AUTOINCREMENT (else the next insert after archive_year takes the
+    largest archived id), start their sequence above every archived id and renumber live rows that clash."""
+    if DIALECT != "sqlite":
+        return
+    raw = engine.raw_connection()
+    con = raw.driver_connection
+    level, con.isolation_level = con.isolation_level, None  # explicit BEGIN: DDL and copy in one transaction
+    try:
+        for model in ARCHIVED_MODELS:
+            t = model.__table__
+            row = con.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (t.name,)).fetchone()
+            if not row or "AUTOINCREMENT" in row[0].upper():
+                continue
+            old_cols = [r[1] for r in con.execute(f"PRAGMA table_info('{t.name}')")]
+            extra = [c for c in old_cols if c not in t.c]
+            if extra:
+                logging.warning("%s not rebuilt for AUTOINCREMENT: unknown columns %s", t.name, extra)
+                continue
+            cols = ", ".join(old_cols)
+            archives = [f"{t.name}_{y}" for y in archived_years(model)]
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                con.execute(f"ALTER TABLE {t.name} RENAME TO {t.name}__rebuild")
+                con.execute(str(CreateTable(t).compile(dialect=engine.dialect)))
+                con.execute(f"INSERT INTO {t.name} ({cols}) SELECT {cols} FROM {t.name}__rebuild")
+                con.execute(f"DROP TABLE {t.name}__rebuild")  # drops the old indexes with it
+                for ix in t.indexes:  # unique keys: _ensure_unique_keys (may fail on legacy duplicates)
+                    if not ix.unique:
+                        con.execute(str(CreateIndex(ix, if_not_exists=True).compile(dialect=engine.dialect)))
+                hw = max([con.execute(f"SELECT COALESCE(MAX(id), 0) FROM {n}").fetchone()[0]
+                          for n in [t.name] + archives])
+                for a in archives:
+                    for (old,) in con.execute(f"SELECT id FROM {t.name} WHERE id IN (SELECT id FROM {a})").fetchall():
+                        hw += 1
+                        con.execute(f"UPDATE {t.name} SET id = ? WHERE id = ?", (hw, old))
+                con.execute("DELETE FROM sqlite_sequence WHERE name = ?", (t.name,))
+                con.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (t.name, hw))
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+    finally:
+        con.isolation_level = level
+        raw.close()
+
+_ensure_autoincrement()
+
+# --------- Uniqueness: partial unique indexes + single-statement inserts ----------
+UNIQUE_KEYS = {CabinetRehab: "code", AssetRehab: "serial_or_code"}
+_unique_indexed: set = set()  # table names whose unique index exists (ON CONFLICT needs it)
+
+def _ensure_unique_keys():
+    for model, col in UNIQUE_KEYS.items():
+        t = model.__table__.name
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(
+                    f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{t}_{col} ON {t} ({col}) WHERE {col} IS NOT NULL"
+                ))
+            _unique_indexed.add(t)
+        except (IntegrityError, OperationalError, ProgrammingError):
+            logging.warning("ux_%s_%s not created: existing duplicates (see /api/validate/duplicates)", t, col)
+
+_ensure_unique_keys()
+
+# month-range reads (reports, exports, dashboard) filter on ARCHIVE_DATE; without these they scan the table
+DATE_INDEXES = {
+    "issue":          ("ix_issue_issue_date",          "issue_date"),
+    "cabinetrehab":   ("ix_cabinetrehab_rehab_date",   "rehab_date"),
+    "assetrehab":     ("ix_assetrehab_effective_date", "COALESCE(rehab_date, supply_date)"),
+    "sparepartrehab": ("ix_sparepartrehab_rehab_date", "rehab_date"),
+}
+
+def _ensure_date_indexes():
+    with engine.begin() as conn:
+        for table, (name, expr) in DATE_INDEXES.items():
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({expr})"))
+        for model in ARCHIVED_MODELS:  # archives made before an index was added
+            for y in archived_years(model):
+                for ix in _archive_table(model, y).indexes:
+                    conn.execute(CreateIndex(ix, if_not_exists=True))
+
+_ensure_date_indexes()
+
+def _ensure_month_indexes():
+    """Postgres: date_trunc('month') indexes for whole-month counts, on live and archive tables."""
+    if DIALECT != "postgres":
+        return
+    with engine.begin() as conn:
+        for model in ARCHIVED_MODELS:
+            t = model.__table__.name
+            for on in [t] + [f"{t}_{y}" for y in archived_years(model)]:
+                pg.ensure_month_indexes(conn, t, on)
+
+_ensure_month_indexes()
+
+def dialect_insert(table):
+    return (pg_insert if DIALECT == "postgres" else sqlite_insert)(table)
+
+def key_taken(model, col: str, value, exclude_id: Optional[int] = None):
+    """SQL condition: `value` is already used in <col> by another live row or by any archive."""
+    conds = []
+    for t in partitions(model):
+        q = sa_select(t.c.id).where(t.c[col] == value)
+        if exclude_id and t is model.__table__:
+            q = q.where(t.c.id != exclude_id)
+        conds.append(q.exists())
+    return or_(*conds)
+
+# --------- Autocomplete sources (field -> columns whose values it suggests) ----------
+SUGGEST_SOURCES: Dict[str, List[Tuple[Any, str]]] = {
+    "location":         [(Issue, "location"), (CabinetRehab, "location"), (AssetRehab, "prev_location")],
+    "current_location": [(AssetRehab, "current_location")],
+    "receiver":         [(Issue, "receiver"), (CabinetRehab, "receiver"), (AssetRehab, "receiver")],
+    "requester":        [(Issue, "requester"), (AssetRehab, "requester")],
+    "qualified_by":     [(Issue, "qualified_by"), (CabinetRehab, "qualified_by"), (AssetRehab, "qualified_by"),
+                         (SparePartRehab, "qualified_by")],
+    "inspector":        [(AssetRehab, "inspector")],
+    "model":            [(Issue, "model"), (AssetRehab, "model")],
+}
+suggester = suggest.Suggester(SUGGEST_SOURCES)
+
+def _suggest_rows():
+    """(field, value, count) for every distinct value in the live tables and archives."""
+    with engine.connect() as conn:
+        for field, sources in SUGGEST_SOURCES.items():
+            for model, col in sources:
+                for t in partitions(model):
+                    c = t.c[col]
+                    for value, n in conn.execute(sa_select(c, func.count()).where(c.is_not(None)).group_by(c)):
+                        yield field, value, n
+
+def _suggest_cols(model) -> List[str]:
+    return [col for sources in SUGGEST_SOURCES.values() for m, col in sources if m is model]
+
+def _suggest_add(model, values: Dict[str, Any]):
+    for field, sources in SUGGEST_SOURCES.items():
+        for m, col in sources:
+            if m is model: suggester.add(field, values.get(col))
+
+def insert_one(model, values: Dict[str, Any], unique_col: Optional[str] = None):
+    """INSERT ... RETURNING in one round trip. With unique_col set (and non-null) the row is inserted only
+    when the key is free in the live table and every archive; ON CONFLICT DO NOTHING closes the race.
+    Returns None when the key was taken."""
+    t = model.__table__
+    key = values.get(unique_col) if unique_col else None
+    if key is None:
+        stmt = insert(t).values(**values)
+    else:
+        cols = list(values)
+        # Postgres can't infer types of bare parameters in a SELECT list
+        lit = (lambda c: cast(literal(values[c], t.c[c].type), t.c[c].type)) if DIALECT == "postgres" \
+              else (lambda c: literal(values[c], t.c[c].type))
+        src = sa_select(*[lit(c).label(c) for c in cols]).where(~key_taken(model, unique_col, key))
+        stmt = dialect_insert(t).from_select(cols, src)
+        if t.name in _unique_indexed:
+            stmt = stmt.on_conflict_do_nothing(index_elements=[unique_col], index_where=t.c[unique_col].is_not(None))
+    with engine.begin() as conn:
+        row = conn.execute(stmt.returning(*t.c)).first()
+    if not row: return None
+    _suggest_add(model, values)
+    return model.model_validate(dict(row._mapping))
+
+def insert_keyed(model, item, dup_msg: str):
+    """Insert `item` keyed on UNIQUE_KEYS[model]; an identical resubmission returns the stored row."""
+    col = UNIQUE_KEYS[model]
+    values = item.dict(exclude={"id"})
+    row = insert_one(model, values, unique_col=col)
+    if row: return row
+    same = find_first(model, col, values[col])
+    if same and all(getattr(same, k) == v for k, v in values.items()):
+        return same
+    raise HTTPException(400, dup_msg)
+
+def find_first(model, col: str, value: str, include_archive: bool = False, exclude_id: Optional[int] = None):
+    """First row with model.<col> == value in the live table, then (optionally) newest archive first."""
+    tables = [model.__table__] + (list(reversed(partitions(model)[:-1])) if include_archive else [])
+    with engine.connect() as conn:
+        for t in tables:
+            q = sa_select(t).where(t.c[col] == value)
+            if exclude_id and t is model.__table__:
+                q = q.where(t.c.id != exclude_id)
+            row = conn.execute(q.limit(1)).first()
+            if row: return model.model_validate(dict(row._mapping))
+    return None
+
 # ===================== App ====================
 app = FastAPI(title="Maintenance Tracker")
 app.add_middleware(
@@ -143,9 +614,138 @@ app.add_middleware(
 )
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# --------- SQLite busy_timeout ran out: a transient 503 the client can retry, not a bare 500 ----------
+def _database_locked(exc: OperationalError) -> bool:
+    return "database is locked" in str(exc.orig)
+
+def _locked_response() -> JSONResponse:
+    return JSONResponse({"detail": "قاعدة البيانات مشغولة، أعد المحاولة بعد قليل"}, status_code=503,
+                        headers={"Retry-After": "1"})
+
+@app.exception_handler(OperationalError)
+async def _operational_error(request: Request, exc: OperationalError):
+    if not _database_locked(exc): raise exc
+    return _locked_response()
+
+# --------- Idempotency-Key for POST endpoints ----------
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+IDEMPOTENCY_KEY_MAX = 200
+_idempotency_pruned_at = 0.0
+
+def _claim_idempotency_key(key: str, path: str) -> Optional[IdempotencyKey]:
+    """Register `key` as in progress; returns the existing record if the key was already claimed."""
+    global _idempotency_pruned_at
+    t = IdempotencyKey.__table__
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        if time.time() - _idempotency_pruned_at > 3600:
+            _idempotency_pruned_at = time.time()
+            conn.execute(delete(t).where(t.c.created_at < now - timedelta(hours=IDEMPOTENCY_TTL_HOURS)))
+        stmt = dialect_insert(t).values(key=key, path=path, status=0, created_at=now)
+        if conn.execute(stmt.on_conflict_do_nothing(index_elements=["key"])).rowcount:
+            return None
+        row = conn.execute(sa_select(t).where(t.c.key == key)).first()
+    return IdempotencyKey.model_validate(dict(row._mapping)) if row else None
+
+def _finish_idempotency_key(key: str, status: Optional[int], content_type: Optional[str] = None, body: bytes = b""):
+    t = IdempotencyKey.__table__
+    with engine.begin() as conn:
+        if status is None:  # failed: release the key so the client can retry
+            conn.execute(delete(t).where(t.c.key == key))
+        else:
+            conn.execute(update(t).where(t.c.key == key).values(status=status, content_type=content_type, body=body))
+
+@app.middleware("http")
+async def idempotency(request: Request, call_next):
+    key = (request.headers.get("idempotency-key") or "").strip()
+    if request.method != "POST" or not key:
+        return await call_next(request)
+    if len(key) > IDEMPOTENCY_KEY_MAX:  # truncating would let two different keys replay each other
+        return JSONResponse({"detail": f"مفتاح Idempotency-Key أطول من {IDEMPOTENCY_KEY_MAX} حرفاً"}, status_code=400)
+    path = request.url.path
+    try:
+        prev = await run_in_threadpool(_claim_idempotency_key, key, path)
+    except OperationalError as e:  # runs outside the app's exception handlers
+        if not _database_locked(e): raise
+        return _locked_response()
+    if prev:
+        if prev.path != path:
+            return JSONResponse({"detail": "مفتاح Idempotency-Key مستخدم لطلب آخر"}, status_code=422)
+        if not prev.status:
+            return JSONResponse({"detail": "الطلب نفسه قيد المعالجة"}, status_code=409, headers={"Retry-After": "1"})
+        return Response(prev.body or b"", status_code=prev.status, media_type=prev.content_type,
+                        headers={"Idempotent-Replayed": "true"})
+    try:
+        response = await call_next(request)
+    except Exception:
+        await run_in_threadpool(_finish_idempotency_key, key, None)
+        raise
+    if response.status_code >= 500:
+        await run_in_threadpool(_finish_idempotency_key, key, None)
+        return response
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    try:
+        await run_in_threadpool(_finish_idempotency_key, key, response.status_code,
+                                response.headers.get("content-type"), body)
+    except OperationalError as e:
+        # the write itself is committed: answer it; a replay of this key reports 409 until the TTL prune
+        if not _database_locked(e): raise
+    return Response(body, status_code=response.status_code, headers=dict(response.headers))
+
+# --------- Admission control: separate pools for writes, reads and heavy reports ----------
+# Registered after the idempotency middleware so it runs first: a 429 never claims an Idempotency-Key.
+admit = admission.Admission()
+HEAVY_PREFIXES = ("/api/export/", "/api/validate/", "/api/import/", "/api/archive/", "/api/backup/snapshot")
+
+def request_class(method: str, path: str) -> Optional[str]:
+    if not path.startswith("/api/") or path.startswith("/api/debug/"):
+        return None
+    if path.startswith(HEAVY_PREFIXES):
+        return "heavy"
+    return "write" if method in ("POST", "PUT", "PATCH", "DELETE") else "read"
+
+async def _release_after(body, pool: admission.Pool):
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        pool.release()
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    slowlog.route.set(f"{request.method} {request.url.path}")  # outermost middleware: tags every statement
+    pool = admit.pool(request_class(request.method, request.url.path))
+    if pool is None:
+        return await call_next(request)
+    if not await pool.acquire():
+        return JSONResponse({"detail": "الخادم مشغول بتقارير أخرى، أعد المحاولة بعد قليل"}, status_code=429,
+                            headers={"Retry-After": str(pool.retry_after)})
+    try:
+        response = await call_next(request)
+    except Exception:
+        pool.release()
+        raise
+    # streamed bodies (CSV) keep their slot until the last chunk is sent
+    response.body_iterator = _release_after(response.body_iterator, pool)
+    return response
+
+snapshots: Optional[backup.SnapshotScheduler] = None
+if DIALECT == "sqlite" and BACKUP_DIR:
+    snapshots = backup.SnapshotScheduler(DB_PATH, BACKUP_DIR, 60 * float(os.getenv("BACKUP_INTERVAL_MIN", "60")))
+
 @app.on_event("startup")
 def _startup():
     _ensure_asset_rehab_date()
+    _ensure_categories()
+    _ensure_unique_keys()
+    _ensure_date_indexes()
+    _ensure_month_indexes()
+    suggester.build(_suggest_rows)
+    if snapshots: snapshots.start()
+
+@app.on_event("shutdown")
+def _shutdown():
+    if snapshots: snapshots.stop()
 
 @app.get("/")
 def root():
@@ -155,6 +755,37 @@ def root():
 def healthz():
     return {"ok": True}
 
+@app.get("/api/debug/admission")
+def admission_stats():
+    return admit.stats()
+
+def _require_slow_query_admin(request: Request):
+    if not SLOW_QUERY_ADMIN_TOKEN: raise HTTPException(404, "غير موجود")
+    if not hmac.compare_digest(request.headers.get("x-admin-token", "").encode(), SLOW_QUERY_ADMIN_TOKEN.encode()):
+        raise HTTPException(403, "غير مصرح")
+
+@app.get("/api/debug/slow_queries")
+def slow_query_log(request: Request, limit: int = Query(50, ge=0, le=1000)):
+    _require_slow_query_admin(request)
+    return slow_queries.snapshot(limit)
+
+@app.delete("/api/debug/slow_queries")
+def clear_slow_query_log(request: Request):
+    _require_slow_query_admin(request)
+    slow_queries.clear()
+    return {"ok": True}
+
+@app.get("/api/suggest/{field}")
+def suggest_values(field: str, prefix: str = "", limit: int = Query(10, ge=1, le=50)):
+    idx = suggester.indexes.get(field)
+    if idx is None: raise HTTPException(404, "غير موجود")
+    if not suggester.ready: suggester.build(_suggest_rows)
+    return [{"value": v, "count": n} for v, n in idx.query(prefix, limit)]
+
+@app.get("/api/categories")
+def list_categories():
+    return {kind: [name for _, name in rows] for kind, rows in _categories()["by_kind"].items()}
+
 # ================ Helpers =====================
 def norm(s: Optional[str]) -> Optional[str]:
     if s is None: return None
@@ -193,15 +824,121 @@ def style_header(ws, cols: int, row: int = 1):
         cell.fill = PatternFill("solid", fgColor="BFE3FF")
         cell.alignment = Alignment(horizontal="center", vertical="center")
 
+_THIN = Side(style="thin", color="999999")
+# one shared object: openpyxl looks every assigned style up in the workbook's style list, and an
+# identical object skips the deep equality check a fresh Border() costs per cell
+THIN_BORDER = Border(top=_THIN, left=_THIN, right=_THIN, bottom=_THIN)
+
 def border_all(ws, cols: int):
-    thin = Side(style="thin", color="999999")
     for r in ws.iter_rows(min_row=1, max_row=ws.max_row, min_col=1, max_col=cols):
-        for c in r: c.border = Border(top=thin, left=thin, right=thin, bottom=thin)
+        for c in r: c.border = THIN_BORDER
+
+# Report sheets stream into write-only workbooks: rows go straight to the file as they are appended (no
+# cell grid kept for wb.save to walk), and each cell takes a named style, one lookup by name instead of
+# hashing its font, fill and border.
+def report_workbook() -> Workbook:
+    wb = Workbook(write_only=True)
+    wb.add_named_style(NamedStyle("rpt_cell", font=DEFAULT_FONT, border=THIN_BORDER))
+    wb.add_named_style(NamedStyle("rpt_header", font=Font(bold=True), fill=PatternFill("solid", fgColor="BFE3FF"),
+                                  alignment=Alignment(horizontal="center", vertical="center"), border=THIN_BORDER))
+    wb.add_named_style(NamedStyle("rpt_total", font=Font(bold=True), border=THIN_BORDER))
+    wb.add_named_style(NamedStyle("rpt_title", font=Font(bold=True, size=14, color="003366"),
+                                  alignment=Alignment(horizontal="right"), border=THIN_BORDER))
+    return wb
+
+def report_sheet(wb: Workbook, title: str):
+    ws = wb.create_sheet(title); ws.sheet_view.rightToLeft = True
+    return ws
+
+def styled(ws, value, style: str = "rpt_cell") -> WriteOnlyCell:
+    c = WriteOnlyCell(ws); c.style = style
+    c.value = value  # after the style: dates keep the number format the value sets
+    return c
+
+def append_row(ws, values, style: str = "rpt_cell"):
+    ws.append([styled(ws, v, style) for v in values])
+
+def table_sheet(wb: Workbook, title: str, headers: List[str], rows):
+    ws = report_sheet(wb, title)
+    append_row(ws, headers, "rpt_header")
+    for r in rows: append_row(ws, r)
+
+def _category_count_select(t: Table, id_col: str, date_of, start: date, end: date, quantity: bool = False):
+    d = date_of(t)
+    # on Postgres a whole-month range is matched via date_trunc so the month expression indexes apply
+    # (built on the live tables and every archive: _ensure_month_indexes, archive_year)
+    whole_month = DIALECT == "postgres" and start.day == 1 and end == month_bounds(start.year, start.month)[1]
+    in_range = (pg.month_key(d) == start) if whole_month else ((d >= start) & (d < end))
+    agg = func.coalesce(func.sum(t.c.quantity), 0) if quantity else func.count()
+    return sa_select(t.c[id_col], agg).where(t.c[id_col].is_not(None), in_range).group_by(t.c[id_col])
+
+def category_counts(conn, tables: List[Table], id_col: str, date_of, start: date, end: date,
+                    quantity: bool = False) -> Dict[int, int]:
+    """{category_id: count|sum(quantity)} for rows with start <= date_of(t) < end, summed over `tables`."""
+    out: Dict[int, int] = {}
+    for t in tables:
+        for cid, v in conn.execute(_category_count_select(t, id_col, date_of, start, end, quantity)).all():
+            out[cid] = out.get(cid, 0) + int(v or 0)
+    return out
+
+def summary_counts(conn, y: int, m: int) -> Dict[int, int]:
+    """Counts per category id for the monthly/quarterly summaries (cabinets counted, assets/spares by quantity)."""
+    start, end = month_bounds(y, m)
+    rehab = lambda t: t.c.rehab_date
+    counts = category_counts(conn, partitions(CabinetRehab, start, end), "cabinet_type_id", rehab, start, end)
+    # أصول: نجمع بالrehab_date، وإن لم يُعبّأ في السجل فلن يُحتسب
+    counts.update(category_counts(conn, partitions(AssetRehab, start, end), "asset_type_id", rehab, start, end,
+                                  quantity=True))
+    counts.update(category_counts(conn, partitions(SparePartRehab, start, end), "part_category_id", rehab,
+                                  start, end, quantity=True))
+    return counts
 
-def year_eq(col, y: int):
-    return func.strftime("%Y", col) == f"{y:04d}" if DIALECT == "sqlite" else func.extract("year", col) == y
-def month_eq(col, m: int):
-    return func.strftime("%m", col) == f"{m:02d}" if DIALECT == "sqlite" else func.extract("month", col) == m
+def _range_select(model, start: Optional[date], end: Optional[date], order: Tuple[str, ...]):
+    """One SELECT over the live table and overlapping archives (UNION ALL), dated in [start, end)."""
+    date_of = ARCHIVE_DATE[model.__table__.name]
+    selects = []
+    for t in partitions(model, start, end):
+        q = sa_select(*t.c)
+        if start and end: q = q.where(date_of(t) >= start, date_of(t) < end)
+        selects.append(q)
+    sub = (selects[0] if len(selects) == 1 else union_all(*selects)).subquery()
+    return sa_select(*sub.c).order_by(*[sub.c[c] for c in order])
+
+def fetch_rows(model, start: Optional[date] = None, end: Optional[date] = None,
+               order: Tuple[str, ...] = ("id",)) -> List[Any]:
+    """Rows of `model` dated in [start, end) (by ARCHIVE_DATE) from the live table and overlapping archives.
+    Streamed in batches (server-side cursor on Postgres)."""
+    rows: List[Any] = []
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=500).execute(
+            _range_select(model, start, end, order))
+        for part in result.partitions():
+            rows.extend(part)
+    return rows
+
+def hot_queries() -> List[Tuple[str, Any]]:
+    """(name, statement) behind the dashboard, finders, duplicate checks and monthly reports, for the current
+    month. `python slowlog.py check` fails if any of them reads a whole table."""
+    today = date.today()
+    start, end = month_bounds(today.year, today.month)
+    rehab = lambda t: t.c.rehab_date
+    out: List[Tuple[str, Any]] = []
+    for model in ARCHIVED_MODELS:
+        out.append((f"month rows {model.__table__.name}", _range_select(model, start, end, ("id",))))
+    for model, id_col, date_of, qty in [
+        (CabinetRehab,   "cabinet_type_id",  rehab,                      False),
+        (AssetRehab,     "asset_type_id",    rehab,                      True),   # monthly summary
+        (AssetRehab,     "asset_type_id",    ARCHIVE_DATE["assetrehab"], False),  # dashboard stats
+        (SparePartRehab, "part_category_id", rehab,                      True),
+    ]:
+        for t in partitions(model, start, end):
+            out.append((f"category counts {t.name}", _category_count_select(t, id_col, date_of, start, end, qty)))
+    for model, col in [(CabinetRehab, "code"), (AssetRehab, "serial_or_code"), (SparePartRehab, "serial")]:
+        for t in partitions(model):
+            out.append((f"find {t.name}.{col}", sa_select(t).where(t.c[col] == "X-1").limit(1)))
+    for model, col in UNIQUE_KEYS.items():
+        out.append((f"key taken {model.__table__.name}.{col}", sa_select(key_taken(model, col, "X-1"))))
+    return out
 
 # ==================== Issue ===================
 @app.post("/api/issue")
@@ -219,37 +956,28 @@ async def add_issue(req: Request):
         qualified_by = norm(f.get("qualified_by")),
         receiver = norm(f.get("receiver")),
     )
-    with Session(engine) as s:
-        s.add(item); s.commit(); s.refresh(item); return item
+    return insert_one(Issue, item.dict(exclude={"id"}))
+
+def sheet_issue_full(wb, rows):
+    headers = ["اسم القطعة","المودل","الرقم التسلسلي","الحالة","العدد","الموقع","جهة الطلب","تاريخ الصرف","المؤهل","المستلم"]
+    table_sheet(wb, "الصرف", headers,
+                ([r.item_name, r.model, r.serial, r.status, r.quantity, r.location, r.requester, r.issue_date,
+                  r.qualified_by, r.receiver] for r in rows))
+
+def sheet_issue_summary(wb, rows):
+    headers = ["اسم القطعة","العدد","الرقم التسلسلي","الموقع الحالي","المستلم"]
+    table_sheet(wb, "ملخص الصرف", headers, ([r.item_name, r.quantity, r.serial, r.location, r.receiver] for r in rows))
 
 @app.get("/api/export/issue/full.xlsx")
 def export_issue_full(year: Optional[int] = None, month: Optional[int] = None):
-    with Session(engine) as s:
-        rows = s.exec(select(Issue).order_by(Issue.issue_date, Issue.id)).all()
-    if year and month:
-        start, end = month_bounds(year, month)
-        rows = [r for r in rows if r.issue_date and start <= r.issue_date < end]
-    wb = Workbook(); ws = wb.active; ws.title = "الصرف"; ws.sheet_view.rightToLeft = True
-    headers = ["اسم القطعة","المودل","الرقم التسلسلي","الحالة","العدد","الموقع","جهة الطلب","تاريخ الصرف","المؤهل","المستلم"]
-    ws.append(headers); style_header(ws, len(headers))
-    for r in rows:
-        ws.append([r.item_name, r.model, r.serial, r.status, r.quantity, r.location, r.requester, r.issue_date, r.qualified_by, r.receiver])
-    border_all(ws, len(headers))
+    start, end = month_bounds(year, month) if year and month else (None, None)
+    wb = report_workbook(); sheet_issue_full(wb, fetch_rows(Issue, start, end, order=("issue_date", "id")))
     return wb_stream(wb, f"issue_full{f'_{year}_{month:02d}' if year and month else ''}.xlsx")
 
 @app.get("/api/export/issue/summary.xlsx")
 def export_issue_summary(year: Optional[int] = None, month: Optional[int] = None):
-    with Session(engine) as s:
-        rows = s.exec(select(Issue).order_by(Issue.issue_date, Issue.id)).all()
-    if year and month:
-        start, end = month_bounds(year, month)
-        rows = [r for r in rows if r.issue_date and start <= r.issue_date < end]
-    wb = Workbook(); ws = wb.active; ws.title = "ملخص الصرف"; ws.sheet_view.rightToLeft = True
-    headers = ["اسم القطعة","العدد","الرقم التسلسلي","الموقع الحالي","المستلم"]
-    ws.append(headers); style_header(ws, len(headers))
-    for r in rows:
-        ws.append([r.item_name, r.quantity, r.serial, r.location, r.receiver])
-    border_all(ws, len(headers))
+    start, end = month_bounds(year, month) if year and month else (None, None)
+    wb = report_workbook(); sheet_issue_summary(wb, fetch_rows(Issue, start, end, order=("issue_date", "id")))
     return wb_stream(wb, f"issue_summary{f'_{year}_{month:02d}' if year and month else ''}.xlsx")
 
 # ================== Cabinets ==================
@@ -257,12 +985,11 @@ def export_issue_summary(year: Optional[int] = None, month: Optional[int] = None
 async def add_cabinet(req: Request):
     f = await req.form()
     code = norm(f.get("code"))
-    if code:
-        with Session(engine) as s:
-            dup = s.exec(select(CabinetRehab).where(CabinetRehab.code == code)).first()
-            if dup: raise HTTPException(400, "الترميز موجود مسبقًا")
+    cabinet_type = norm(f.get("cabinet_type")) or ""
+    cabinet_type_id = category_id("cab", cabinet_type)
     item = CabinetRehab(
-        cabinet_type = f.get("cabinet_type") or "",
+        cabinet_type = cabinet_type,
+        cabinet_type_id = cabinet_type_id,
         code = code,
         rehab_date = to_date(f.get("rehab_date")) or date.today(),
         qualified_by = norm(f.get("qualified_by")),
@@ -271,45 +998,40 @@ async def add_cabinet(req: Request):
         issue_date = to_date(f.get("issue_date")),
         notes = norm(f.get("notes")),
     )
-    with Session(engine) as s:
-        s.add(item); s.commit(); s.refresh(item); return item
+    return insert_keyed(CabinetRehab, item, "الترميز موجود مسبقًا")
 
 @app.get("/api/cabinets/find")
-def find_cabinet(code: str = Query(...)):
-    with Session(engine) as s:
-        obj = s.exec(select(CabinetRehab).where(CabinetRehab.code == code)).first()
-        if not obj: raise HTTPException(404, "غير موجود")
-        return obj
+def find_cabinet(code: str = Query(...), include_archive: bool = Query(False)):
+    obj = find_first(CabinetRehab, "code", code, include_archive)
+    if not obj: raise HTTPException(404, "غير موجود")
+    return obj
 
 @app.get("/api/stats/cabinets")
 def stats_cabinets(year: int, month: int):
-    cats = ["ATS","AMF","HYBRID","حماية انفرتر","ظفيرة تحكم"]
-    res = {k:0 for k in cats}
-    with Session(engine) as s:
-        q = select(CabinetRehab).where(year_eq(CabinetRehab.rehab_date, year),
-                                       month_eq(CabinetRehab.rehab_date, month))
-        for r in s.exec(q).all():
-            if r.cabinet_type in res: res[r.cabinet_type] += 1
-    return res
+    start, end = month_bounds(year, month)
+    with engine.connect() as conn:
+        counts = category_counts(conn, partitions(CabinetRehab, start, end), "cabinet_type_id",
+                                 lambda t: t.c.rehab_date, start, end)
+    return {name: counts.get(cid, 0) for cid, name in _categories()["by_kind"]["cab"]}
+
+def sheet_cabinets(wb, rows):
+    headers = ["نوع الكبينة","الترميز","تاريخ التأهيل","المؤهل","الموقع","المستلم","تاريخ الصرف","ملاحظات"]
+    table_sheet(wb, "الكبائن", headers,
+                ([r.cabinet_type, r.code, r.rehab_date, r.qualified_by, r.location, r.receiver, r.issue_date, r.notes]
+                 for r in rows))
 
 @app.get("/api/export/cabinets.xlsx")
 def export_cabinets(year: int, month: int):
-    with Session(engine) as s:
-        q = select(CabinetRehab).where(year_eq(CabinetRehab.rehab_date, year),
-                                       month_eq(CabinetRehab.rehab_date, month)).order_by(CabinetRehab.rehab_date, CabinetRehab.id)
-        rows = s.exec(q).all()
-    wb = Workbook(); ws = wb.active; ws.title = "الكبائن"; ws.sheet_view.rightToLeft = True
-    headers = ["نوع الكبينة","الترميز","تاريخ التأهيل","المؤهل","الموقع","المستلم","تاريخ الصرف","ملاحظات"]
-    ws.append(headers); style_header(ws, len(headers))
-    for r in rows:
-        ws.append([r.cabinet_type, r.code, r.rehab_date, r.qualified_by, r.location, r.receiver, r.issue_date, r.notes])
-    border_all(ws, len(headers))
+    start, end = month_bounds(year, month)
+    wb = report_workbook(); sheet_cabinets(wb, fetch_rows(CabinetRehab, start, end, order=("rehab_date", "id")))
     return wb_stream(wb, f"cabinets_{year}_{month:02d}.xlsx")
 
 # ==================== Assets ==================
 def _coerce_asset_payload(d: Dict[str, Any]) -> AssetRehab:
+    asset_type = norm(d.get("asset_type")) or ""
     return AssetRehab(
-        asset_type = d.get("asset_type") or "",
+        asset_type = asset_type,
+        asset_type_id = category_id("ast", asset_type),
         model = norm(d.get("model")),
         serial_or_code = norm(d.get("serial_or_code")),
         quantity = to_int(d.get("quantity") or "1", 1),
@@ -327,46 +1049,46 @@ def _coerce_asset_payload(d: Dict[str, Any]) -> AssetRehab:
         rehab_date = to_date(d.get("rehab_date")),
     )
 
-def _asset_duplicate_exists(s: Session, serial_or_code: Optional[str], exclude_id: Optional[int] = None) -> bool:
-    if not serial_or_code: return False
-    q = select(AssetRehab.id).where(AssetRehab.serial_or_code == serial_or_code)
-    for (rid,) in s.exec(q).all():
-        if exclude_id and rid == exclude_id: continue
-        return True
-    return False
+ASSET_DUP_MSG = "هناك تكرار في الرقم التسلسلي/الترميز"
 
 @app.post("/api/assets")
 async def add_asset(req: Request):
     data = await (req.json() if "application/json" in (req.headers.get("content-type") or "") else req.form())
     if not isinstance(data, dict): data = dict(data)
-    item = _coerce_asset_payload(data)
-    with Session(engine) as s:
-        if item.serial_or_code and _asset_duplicate_exists(s, item.serial_or_code):
-            raise HTTPException(400, "هناك تكرار في الرقم التسلسلي/الترميز")
-        s.add(item); s.commit(); s.refresh(item); return item
+    return insert_keyed(AssetRehab, _coerce_asset_payload(data), ASSET_DUP_MSG)
 
 @app.put("/api/assets/{aid}")
 async def update_asset(aid: int, req: Request):
     data = await (req.json() if "application/json" in (req.headers.get("content-type") or "") else req.form())
     if not isinstance(data, dict): data = dict(data)
-    with Session(engine) as s:
-        obj = s.get(AssetRehab, aid)
-        if not obj: raise HTTPException(404, "غير موجود")
-        new_serial = norm(data.get("serial_or_code"))
-        if new_serial and new_serial != obj.serial_or_code:
-            if _asset_duplicate_exists(s, new_serial, exclude_id=aid):
-                raise HTTPException(400, "هناك تكرار في الرقم التسلسلي/الترميز")
-        patch = _coerce_asset_payload(data).dict()
-        patch.pop("id", None)
-        for k, v in patch.items(): setattr(obj, k, v)
-        s.add(obj); s.commit(); s.refresh(obj); return obj
+    t = AssetRehab.__table__
+    patch = _coerce_asset_payload(data).dict(exclude={"id"})
+    new_serial = patch["serial_or_code"]
+    stmt = update(t).where(t.c.id == aid).values(**patch)
+    if new_serial:
+        # الرقم لم يتغير، أو غير مستخدم في سجل آخر/الأرشيف
+        stmt = stmt.where(or_(t.c.serial_or_code == new_serial,
+                              ~key_taken(AssetRehab, "serial_or_code", new_serial, exclude_id=aid)))
+    watched = _suggest_cols(AssetRehab)
+    try:
+        with engine.begin() as conn:
+            # suggested fields before the edit (row locked on Postgres): only changed values are counted
+            old = conn.execute(sa_select(*[t.c[c] for c in watched]).where(t.c.id == aid).with_for_update()).first()
+            row = conn.execute(stmt.returning(*t.c)).first()
+    except IntegrityError:
+        raise HTTPException(400, ASSET_DUP_MSG)
+    if not row:
+        with engine.connect() as conn:
+            exists_ = conn.execute(sa_select(t.c.id).where(t.c.id == aid)).first()
+        raise HTTPException(400, ASSET_DUP_MSG) if exists_ else HTTPException(404, "غير موجود")
+    _suggest_add(AssetRehab, {c: patch[c] for c in watched if patch[c] != old._mapping[c]})
+    return AssetRehab.model_validate(dict(row._mapping))
 
 @app.get("/api/assets/find")
-def find_asset(serial: str = Query(...)):
-    with Session(engine) as s:
-        obj = s.exec(select(AssetRehab).where(AssetRehab.serial_or_code == serial)).first()
-        if not obj: raise HTTPException(404, "غير موجود")
-        return obj
+def find_asset(serial: str = Query(...), include_archive: bool = Query(False)):
+    obj = find_first(AssetRehab, "serial_or_code", serial, include_archive)
+    if not obj: raise HTTPException(404, "غير موجود")
+    return obj
 
 @app.get("/api/stats/assets")
 def stats_assets(
@@ -374,50 +1096,38 @@ def stats_assets(
     month: int = Query(..., ge=1, le=12, description="الشهر 1..12"),
     date_field: str = Query("rehab_date", description="rehab_date أو supply_date")
 ):
-    col = AssetRehab.supply_date if date_field == "supply_date" else func.coalesce(AssetRehab.rehab_date, AssetRehab.supply_date)
-    with Session(engine) as s:
-        rows = s.exec(
-            select(AssetRehab.asset_type, func.count(AssetRehab.id))
-            .where(col.is_not(None), year_eq(col, year), month_eq(col, month))
-            .group_by(AssetRehab.asset_type)
-        ).all()
-    counts = {k: v for (k, v) in rows}
-    return {
-        "بطاريات":   int(counts.get("بطاريات", 0)),
-        "موحدات":    int(counts.get("موحدات", 0)),
-        "محركات":    int(counts.get("محركات", 0)),
-        "مولدات":    int(counts.get("مولدات", 0)),
-        "مكيفات":    int(counts.get("مكيفات", 0)),
-        "أصول أخرى": int(counts.get("أصول أخرى", 0)),
-    }
+    start, end = month_bounds(year, month)
+    if date_field == "supply_date":
+        # التوريد يسبق التأهيل: السجل قد يكون مؤرشفًا في سنة لاحقة لتاريخ توريده
+        date_of, tables = (lambda t: t.c.supply_date), partitions(AssetRehab, start, None)
+    else:
+        date_of, tables = ARCHIVE_DATE["assetrehab"], partitions(AssetRehab, start, end)
+    with engine.connect() as conn:
+        counts = category_counts(conn, tables, "asset_type_id", date_of, start, end)
+    return {name: counts.get(cid, 0) for cid, name in _categories()["by_kind"]["ast"]}
 
-def _asset_in_range(r: AssetRehab, start: date, end: date) -> bool:
-    d = r.rehab_date or r.supply_date
-    return bool(d and start <= d < end)
+def sheet_assets(wb, rows):
+    headers = ["نوع الأصل","المودل","الرقم التسلسلي/الترميز","العدد","الموقع السابق","تاريخ التوريد",
+               "المؤهل","الرفع","الفاحص","الفحص","تاريخ الصرف","الموقع الحالي","جهة الطلب","المستلم","ملاحظات","تاريخ التأهيل"]
+    table_sheet(wb, "الأصول", headers,
+                ([r.asset_type, r.model, r.serial_or_code, r.quantity, r.prev_location, r.supply_date,
+                  r.qualified_by, r.lifted, r.inspector, r.tested, r.issue_date, r.current_location,
+                  r.requester, r.receiver, r.notes, r.rehab_date] for r in rows))
 
 @app.get("/api/export/assets.xlsx")
 def export_assets(year: int, month: int):
     start, end = month_bounds(year, month)
-    with Session(engine) as s:
-        rows_all = s.exec(select(AssetRehab)).all()
-        rows = [r for r in rows_all if _asset_in_range(r, start, end)]
-    wb = Workbook(); ws = wb.active; ws.title = "الأصول"; ws.sheet_view.rightToLeft = True
-    headers = ["نوع الأصل","المودل","الرقم التسلسلي/الترميز","العدد","الموقع السابق","تاريخ التوريد",
-               "المؤهل","الرفع","الفاحص","الفحص","تاريخ الصرف","الموقع الحالي","جهة الطلب","المستلم","ملاحظات","تاريخ التأهيل"]
-    ws.append(headers); style_header(ws, len(headers))
-    for r in rows:
-        ws.append([r.asset_type, r.model, r.serial_or_code, r.quantity, r.prev_location, r.supply_date,
-                   r.qualified_by, r.lifted, r.inspector, r.tested, r.issue_date, r.current_location,
-                   r.requester, r.receiver, r.notes, r.rehab_date])
-    border_all(ws, len(headers))
+    wb = report_workbook(); sheet_assets(wb, fetch_rows(AssetRehab, start, end))
     return wb_stream(wb, f"assets_{year}_{month:02d}.xlsx")
 
 # ==================== Spares ==================
 @app.post("/api/spares")
 async def add_spare(req: Request):
     f = await req.form()
+    part_category = norm(f.get("part_category")) or ""
     item = SparePartRehab(
-        part_category = f.get("part_category") or "",
+        part_category = part_category,
+        part_category_id = category_id("spa", part_category),
         part_name = norm(f.get("part_name")),
         part_model = norm(f.get("part_model")),
         quantity = to_int(f.get("quantity") or "1", 1),
@@ -428,73 +1138,69 @@ async def add_spare(req: Request):
         tested = to_bool(f.get("tested")),
         notes = norm(f.get("notes")),
     )
-    with Session(engine) as s:
-        s.add(item); s.commit(); s.refresh(item); return item
+    return insert_one(SparePartRehab, item.dict(exclude={"id"}))
 
 @app.get("/api/spares/find")
-def find_spare(serial: str = Query(...)):
-    with Session(engine) as s:
-        obj = s.exec(select(SparePartRehab).where(SparePartRehab.serial == serial)).first()
-        if not obj: raise HTTPException(404, "غير موجود")
-        return obj
+def find_spare(serial: str = Query(...), include_archive: bool = Query(False)):
+    obj = find_first(SparePartRehab, "serial", serial, include_archive)
+    if not obj: raise HTTPException(404, "غير موجود")
+    return obj
 
 @app.get("/api/stats/spares")
 def stats_spares(year: int, month: int):
-    with Session(engine) as s:
-        rows = s.exec(
-            select(SparePartRehab.part_category, func.coalesce(func.sum(SparePartRehab.quantity), 0))
-            .where(year_eq(SparePartRehab.rehab_date, year), month_eq(SparePartRehab.rehab_date, month))
-            .group_by(SparePartRehab.part_category)
-        ).all()
-    cats = ["مضخات الديزل","النوزلات","سلف","دينمو شحن","كروت وشواحن","موديولات","منظمات وانفرترات","تسييخ","أخرى"]
-    res = {k:0 for k in cats}
-    for k, v in rows:
-        if k in res: res[k] = int(v or 0)
-    return res
+    start, end = month_bounds(year, month)
+    with engine.connect() as conn:
+        counts = category_counts(conn, partitions(SparePartRehab, start, end), "part_category_id",
+                                 lambda t: t.c.rehab_date, start, end, quantity=True)
+    return {name: counts.get(cid, 0) for cid, name in _categories()["by_kind"]["spa"]}
+
+def sheet_spares(wb, rows):
+    headers = ["نوع القطعة","اسم القطعة","موديل القطعة","العدد","الرقم التسلسلي","المصدر","المؤهل","تاريخ التأهيل","الفحص","ملاحظات"]
+    table_sheet(wb, "قطع الغيار", headers,
+                ([r.part_category, r.part_name, r.part_model, r.quantity, r.serial, r.source, r.qualified_by,
+                  r.rehab_date, r.tested, r.notes] for r in rows))
 
 @app.get("/api/export/spares.xlsx")
 def export_spares(year: int, month: int):
-    with Session(engine) as s:
-        q = select(SparePartRehab).where(year_eq(SparePartRehab.rehab_date, year),
-                                         month_eq(SparePartRehab.rehab_date, month)).order_by(SparePartRehab.rehab_date, SparePartRehab.id)
-        rows = s.exec(q).all()
-    wb = Workbook(); ws = wb.active; ws.title = "قطع الغيار"; ws.sheet_view.rightToLeft = True
-    headers = ["نوع القطعة","اسم القطعة","موديل القطعة","العدد","الرقم التسلسلي","المصدر","المؤهل","تاريخ التأهيل","الفحص","ملاحظات"]
-    ws.append(headers); style_header(ws, len(headers))
-    for r in rows:
-        ws.append([r.part_category, r.part_name, r.part_model, r.quantity, r.serial, r.source, r.qualified_by, r.rehab_date, r.tested, r.notes])
-    border_all(ws, len(headers))
+    start, end = month_bounds(year, month)
+    wb = report_workbook(); sheet_spares(wb, fetch_rows(SparePartRehab, start, end, order=("rehab_date", "id")))
     return wb_stream(wb, f"spares_{year}_{month:02d}.xlsx")
 
 # ============ Duplicates validator ============
 @app.get("/api/validate/duplicates")
-def validate_duplicates():
-    with Session(engine) as s:
+def validate_duplicates(include_archive: bool = Query(False)):
+    def tables(model) -> List[Table]:
+        return partitions(model) if include_archive else [model.__table__]
+
+    with engine.connect() as conn:
         # cabinets
         code_counts: Dict[str,int] = {}
-        for r in s.exec(select(CabinetRehab)).all():
-            if r.code:
-                code_counts[r.code] = code_counts.get(r.code, 0) + 1
+        for t in tables(CabinetRehab):
+            for (code,) in conn.execute(sa_select(t.c.code).where(t.c.code.is_not(None))):
+                if code:
+                    code_counts[code] = code_counts.get(code, 0) + 1
         cabinets_codes = [k for k,v in code_counts.items() if v > 1]
 
         # assets
         ser_counts: Dict[str,int] = {}
         ser_loc_counts: Dict[Tuple[str,str],int] = {}
-        for r in s.exec(select(AssetRehab)).all():
-            sn = r.serial_or_code or ""
-            if sn:
-                ser_counts[sn] = ser_counts.get(sn, 0) + 1
-                key = (sn, r.current_location or "")
-                ser_loc_counts[key] = ser_loc_counts.get(key, 0) + 1
+        for t in tables(AssetRehab):
+            for (sn, loc) in conn.execute(sa_select(t.c.serial_or_code, t.c.current_location)
+                                          .where(t.c.serial_or_code.is_not(None))):
+                if sn:
+                    ser_counts[sn] = ser_counts.get(sn, 0) + 1
+                    key = (sn, loc or "")
+                    ser_loc_counts[key] = ser_loc_counts.get(key, 0) + 1
         assets_serials = [k for k,v in ser_counts.items() if v > 1]
         assets_serial_loc_pairs = [f"{a}@{b}" for (a,b),v in ser_loc_counts.items() if v > 1]
 
         # spares
         ss: Dict[Tuple[str,str],int] = {}
-        for r in s.exec(select(SparePartRehab)).all():
-            key = (r.serial or "", r.source or "")
-            if key != ("",""):
-                ss[key] = ss.get(key, 0) + 1
+        for t in tables(SparePartRehab):
+            for (sn, src) in conn.execute(sa_select(t.c.serial, t.c.source)):
+                key = (sn or "", src or "")
+                if key != ("",""):
+                    ss[key] = ss.get(key, 0) + 1
         spares_serial_src_pairs = [f"{a}@{b}" for (a,b),v in ss.items() if v > 1]
 
     return {
@@ -507,77 +1213,27 @@ def validate_duplicates():
 # ======= Monthly & Quarterly summaries ========
 AR_MONTHS = ["يناير","فبراير","مارس","أبريل","مايو","يونيو","يوليو","أغسطس","سبتمبر","أكتوبر","نوفمبر","ديسمبر"]
 
+def sheet_monthly_summary(wb, year: int, month: int, counts: Dict[int, int]):
+    ws = report_sheet(wb, "ملخص شهري")
+    mname = AR_MONTHS[month-1]
+    ws.merged_cells.add("A1:E1")
+    ws.append([styled(ws, f"أهم الإنجازات التي تمت في مركز الإصلاحات الفنية خلال شهر {mname} {year} م:", "rpt_title")]
+              + [styled(ws, None) for _ in range(4)])
+    # the report's layout: column titles on row 2, an empty header-styled row 3, the categories from row 4
+    append_row(ws, ["م","الصنف", mname])
+    append_row(ws, [None] * 3, "rpt_header")
+    total = 0
+    for i,(label,cid) in enumerate(report_rows(), start=1):
+        v = counts.get(cid, 0)
+        append_row(ws, [i, label, v])
+        total += v
+    ws.append([styled(ws, None), styled(ws, "الإجمالي", "rpt_total"), styled(ws, total, "rpt_total")])
+
 @app.get("/api/export/monthly_summary.xlsx")
 def export_monthly_summary(year: int, month: int):
-    # counts using rehab_date (وإن لم يوجد يرجع الأصل بلا احتساب)
-    with Session(engine) as s:
-        cab_rows = s.exec(
-            select(CabinetRehab.cabinet_type, func.count(CabinetRehab.id))
-            .where(year_eq(CabinetRehab.rehab_date, year), month_eq(CabinetRehab.rehab_date, month))
-            .group_by(CabinetRehab.cabinet_type)
-        ).all()
-        cab = {"ATS":0,"AMF":0,"HYBRID":0,"حماية انفرتر":0,"ظفيرة تحكم":0}
-        for k, v in cab_rows:
-            if k in cab: cab[k] = int(v or 0)
-
-        # أصول: نجمع بالrehab_date، وإن لم يُعبّأ في السجل فلن يُحتسب
-        ast_rows = s.exec(
-            select(AssetRehab.asset_type, func.coalesce(func.sum(AssetRehab.quantity), 0))
-            .where(AssetRehab.rehab_date.is_not(None),
-                   year_eq(AssetRehab.rehab_date, year),
-                   month_eq(AssetRehab.rehab_date, month))
-            .group_by(AssetRehab.asset_type)
-        ).all()
-        ast = {"بطاريات":0,"موحدات":0,"محركات":0,"مولدات":0,"مكيفات":0,"أصول أخرى":0}
-        for k, v in ast_rows:
-            if k in ast: ast[k] = int(v or 0)
-
-        spa_rows = s.exec(
-            select(SparePartRehab.part_category, func.coalesce(func.sum(SparePartRehab.quantity), 0))
-            .where(year_eq(SparePartRehab.rehab_date, year), month_eq(SparePartRehab.rehab_date, month))
-            .group_by(SparePartRehab.part_category)
-        ).all()
-        spa = {"مضخات الديزل":0,"النوزلات":0,"سلف":0,"دينمو شحن":0,"كروت وشواحن":0,"موديولات":0,"منظمات وانفرترات":0,"تسييخ":0,"أخرى":0}
-        for k, v in spa_rows:
-            if k in spa: spa[k] = int(v or 0)
-
-    rows_map = [
-        ("تجميع كبائن تحكم ATS",         ("cab", "ATS")),
-        ("تجميع كبائن تحكم ATS HYBRID",  ("cab", "HYBRID")),
-        ("تجميع كبائن تحكم AMF",         ("cab", "AMF")),
-        ("تجميع ظفائر مولدات",           ("cab", "ظفيرة تحكم")),
-        ("تأهيل موحدات",                  ("ast", "موحدات")),
-        ("تأهيل بطاريات",                 ("ast", "بطاريات")),
-        ("تأهيل محركات",                  ("ast", "محركات")),
-        ("تأهيل مولدات",                  ("ast", "مولدات")),
-        ("تأهيل مكيفات",                  ("ast", "مكيفات")),
-        ("تأهيل أصول أخرى",               ("ast", "أصول أخرى")),
-        ("إصلاح موديولات",                ("spa", "موديولات")),
-        ("إصلاح دينمو شحن",               ("spa", "دينمو شحن")),
-        ("إصلاح سلف مولد",                ("spa", "سلف")),
-        ("إصلاح منظمات شمسية وإنفرترات", ("spa", "منظمات وانفرترات")),
-        ("إصلاح كروت وشواحن",            ("spa", "كروت وشواحن")),
-        ("إصلاح قطع غيار أخرى",           ("spa", "أخرى")),
-    ]
-    wb = Workbook(); ws = wb.active; ws.title="ملخص شهري"; ws.sheet_view.rightToLeft=True
-    mname = AR_MONTHS[month-1]
-    ws.merge_cells("A1:E1")
-    ws["A1"].value = f"أهم الإنجازات التي تمت في مركز الإصلاحات الفنية خلال شهر {mname} {year} م:"
-    ws["A1"].font = Font(bold=True, size=14, color="003366")
-    ws["A1"].alignment = Alignment(horizontal="right")
-
-    headers = ["م","الصنف", mname]
-    ws.append(headers); style_header(ws, len(headers), row=3)
-    total = 0; r = 4
-    for i,(label,(kind,key)) in enumerate(rows_map, start=1):
-        ws.cell(row=r, column=1, value=i)
-        ws.cell(row=r, column=2, value=label)
-        v = (cab if kind=="cab" else ast if kind=="ast" else spa).get(key, 0)
-        ws.cell(row=r, column=3, value=v)
-        total += v; r += 1
-    ws.cell(row=r, column=2, value="الإجمالي").font = Font(bold=True)
-    ws.cell(row=r, column=3, value=total).font = Font(bold=True)
-    border_all(ws, 3)
+    with engine.connect() as conn:
+        counts = summary_counts(conn, year, month)
+    wb = report_workbook(); sheet_monthly_summary(wb, year, month, counts)
     return wb_stream(wb, f"monthly_{year}_{month:02d}.xlsx")
 
 @app.get("/api/export/quarterly_summary.xlsx")
@@ -588,73 +1244,23 @@ def export_quarterly_summary(start_year: int, start_month: int):
         months.append((y,m)); m += 1
         if m == 13: m = 1; y += 1
 
-    rows_map = [
-        ("تجميع كبائن تحكم ATS",         ("cab", "ATS")),
-        ("تجميع كبائن تحكم ATS HYBRID",  ("cab", "HYBRID")),
-        ("تجميع كبائن تحكم AMF",         ("cab", "AMF")),
-        ("تجميع ظفائر مولدات",           ("cab", "ظفيرة تحكم")),
-        ("تأهيل موحدات",                  ("ast", "موحدات")),
-        ("تأهيل بطاريات",                 ("ast", "بطاريات")),
-        ("تأهيل محركات",                  ("ast", "محركات")),
-        ("تأهيل مولدات",                  ("ast", "مولدات")),
-        ("تأهيل مكيفات",                  ("ast", "مكيفات")),
-        ("تأهيل أصول أخرى",               ("ast", "أصول أخرى")),
-        ("إصلاح موديولات",                ("spa", "موديولات")),
-        ("إصلاح دينمو شحن",               ("spa", "دينمو شحن")),
-        ("إصلاح سلف مولد",                ("spa", "سلف")),
-        ("إصلاح منظمات شمسية وإنفرترات", ("spa", "منظمات وانفرترات")),
-        ("إصلاح كروت وشواحن",            ("spa", "كروت وشواحن")),
-        ("إصلاح قطع غيار أخرى",           ("spa", "أخرى")),
-    ]
-
-    monthly_counts: List[Dict[str,int]] = []
-    with Session(engine) as s:
+    rows_map = report_rows()
+    monthly_counts: List[Dict[int,int]] = []
+    with engine.connect() as conn:
         for (yy, mm) in months:
-            cab_rows = s.exec(
-                select(CabinetRehab.cabinet_type, func.count(CabinetRehab.id))
-                .where(year_eq(CabinetRehab.rehab_date, yy), month_eq(CabinetRehab.rehab_date, mm))
-                .group_by(CabinetRehab.cabinet_type)
-            ).all()
-            cab = {"ATS":0,"AMF":0,"HYBRID":0,"حماية انفرتر":0,"ظفيرة تحكم":0}
-            for k, v in cab_rows:
-                if k in cab: cab[k] = int(v or 0)
-
-            ast_rows = s.exec(
-                select(AssetRehab.asset_type, func.coalesce(func.sum(AssetRehab.quantity), 0))
-                .where(AssetRehab.rehab_date.is_not(None),
-                       year_eq(AssetRehab.rehab_date, yy),
-                       month_eq(AssetRehab.rehab_date, mm))
-                .group_by(AssetRehab.asset_type)
-            ).all()
-            ast = {"بطاريات":0,"موحدات":0,"محركات":0,"مولدات":0,"مكيفات":0,"أصول أخرى":0}
-            for k, v in ast_rows:
-                if k in ast: ast[k] = int(v or 0)
-
-            spa_rows = s.exec(
-                select(SparePartRehab.part_category, func.coalesce(func.sum(SparePartRehab.quantity), 0))
-                .where(year_eq(SparePartRehab.rehab_date, yy), month_eq(SparePartRehab.rehab_date, mm))
-                .group_by(SparePartRehab.part_category)
-            ).all()
-            spa = {"مضخات الديزل":0,"النوزلات":0,"سلف":0,"دينمو شحن":0,"كروت وشواحن":0,"موديولات":0,"منظمات وانفرترات":0,"تسييخ":0,"أخرى":0}
-            for k, v in spa_rows:
-                if k in spa: spa[k] = int(v or 0)
-
-            cols: Dict[str,int] = {}
-            for label,(kind,key) in rows_map:
-                cols[label] = (cab if kind=="cab" else ast if kind=="ast" else spa).get(key, 0)
-            monthly_counts.append(cols)
+            monthly_counts.append(summary_counts(conn, yy, mm))
 
     wb = Workbook(); ws = wb.active; ws.title="ملخص ربع سنوي"; ws.sheet_view.rightToLeft=True
     headers = ["م","الصنف"] + [AR_MONTHS[m-1] for (_,m) in months] + ["الربع"]
     ws.append(headers); style_header(ws, len(headers))
     total_per_month = [0,0,0]; grand_total = 0
     r = 2
-    for i,(label,_) in enumerate(rows_map, start=1):
+    for i,(label,cid) in enumerate(rows_map, start=1):
         ws.cell(row=r, column=1, value=i)
         ws.cell(row=r, column=2, value=label)
         row_sum = 0
         for mi in range(3):
-            v = monthly_counts[mi][label]
+            v = monthly_counts[mi].get(cid, 0)
             ws.cell(row=r, column=3+mi, value=v)
             row_sum += v; total_per_month[mi]+=v
         ws.cell(row=r, column=6, value=row_sum)
@@ -665,3 +1271,164 @@ def export_quarterly_summary(start_year: int, start_month: int):
     ws.cell(row=r, column=6, value=grand_total).font = Font(bold=True)
     border_all(ws, len(headers))
     return wb_stream(wb, f"quarterly_{months[0][0]}_{months[0][1]:02d}.xlsx")
+
+# ================= Month pack =================
+# كل تقارير الشهر في ملف واحد: كل جدول يُقرأ مرة واحدة، والملخص يُحسب من نفس الصفوف
+MONTH_PACK = [  # (model, order): each table's month is fetched once and feeds every sheet built from it
+    (CabinetRehab,   ("rehab_date", "id")),
+    (AssetRehab,     ("id",)),
+    (SparePartRehab, ("rehab_date", "id")),
+    (Issue,          ("issue_date", "id")),
+]
+
+def summary_counts_from_rows(start: date, end: date, cabinets, assets, spares) -> Dict[int, int]:
+    """summary_counts() over already-fetched month rows: cabinets counted, assets/spares by quantity,
+    all by rehab_date (asset rows fetched by supply_date alone don't count)."""
+    counts: Dict[int, int] = {}
+    for rows, id_col, qty in ((cabinets, "cabinet_type_id", False), (assets, "asset_type_id", True),
+                              (spares, "part_category_id", True)):
+        for r in rows:
+            cid = getattr(r, id_col)
+            if cid is None or not r.rehab_date or not (start <= r.rehab_date < end): continue
+            counts[cid] = counts.get(cid, 0) + ((r.quantity or 0) if qty else 1)
+    return counts
+
+@app.get("/api/export/month_pack.xlsx")
+def export_month_pack(year: int = Query(...), month: int = Query(..., ge=1, le=12)):
+    start, end = month_bounds(year, month)
+    rows = {model: fetch_rows(model, start, end, order=order) for model, order in MONTH_PACK}
+    counts = summary_counts_from_rows(start, end, rows[CabinetRehab], rows[AssetRehab], rows[SparePartRehab])
+    wb = report_workbook()
+    sheet_monthly_summary(wb, year, month, counts)
+    sheet_cabinets(wb, rows[CabinetRehab])
+    sheet_assets(wb, rows[AssetRehab])
+    sheet_spares(wb, rows[SparePartRehab])
+    sheet_issue_full(wb, rows[Issue])
+    sheet_issue_summary(wb, rows[Issue])
+    return wb_stream(wb, f"month_pack_{year}_{month:02d}.xlsx")
+
+# ================== Archive ===================
+@app.get("/api/archive")
+def list_archive():
+    with Session(engine) as s:
+        return s.exec(select(ArchiveYear).order_by(ArchiveYear.year, ArchiveYear.table_name)).all()
+
+@app.post("/api/archive/{year}")
+def archive_closed_year(year: int):
+    if year >= date.today().year:
+        raise HTTPException(400, "لا يمكن أرشفة سنة لم تُغلق بعد")
+    return {"year": year, "moved": archive_year(year)}
+
+# ================== Backups ===================
+def _require_snapshots() -> backup.SnapshotScheduler:
+    if not snapshots: raise HTTPException(400, "النسخ الاحتياطي غير مفعّل (BACKUP_DIR)")
+    return snapshots
+
+@app.get("/api/backup")
+def list_backups():
+    sch = _require_snapshots()
+    return {
+        "dir": sch.backup_dir,
+        "snapshots": [os.path.basename(p) for p in backup.list_snapshots(sch.backup_dir)],
+        "restored_from": RESTORED_FROM and os.path.basename(RESTORED_FROM),
+        "last_error": sch.last_error,
+    }
+
+@app.post("/api/backup/snapshot")
+def take_snapshot():
+    sch = _require_snapshots()
+    try:
+        return {"snapshot": os.path.basename(sch.take())}
+    except TimeoutError:
+        raise HTTPException(503, "قاعدة البيانات مشغولة؛ لم تكتمل النسخة الاحتياطية، أعد المحاولة لاحقًا")
+
+# ============== CSV export / bulk load ==============
+CSV_MODELS = {"issue": Issue, "cabinets": CabinetRehab, "assets": AssetRehab, "spares": SparePartRehab}
+CSV_ORDER = {"issue": ("issue_date", "id"), "cabinets": ("rehab_date", "id"), "assets": ("id",), "spares": ("rehab_date", "id")}
+
+def _csv_model(name: str):
+    model = CSV_MODELS.get(name)
+    if not model: raise HTTPException(404, "غير موجود")
+    return model
+
+def _csv_cell(v) -> str:
+    if v is None: return ""
+    if isinstance(v, bool): return "true" if v else "false"
+    return str(v)
+
+def _csv_value(col, v: str):
+    if v is None or v == "": return None
+    try: t = col.type.python_type
+    except NotImplementedError: return v  # AutoString
+    if t is date: return to_date(v)
+    if t is datetime: return datetime.fromisoformat(v)
+    if t is bool: return v.strip().lower() in ("1","t","true","yes","y","on","نعم")
+    if t is int: return int(v)
+    return v
+
+def _iter_csv(stmt):
+    """SQLite counterpart of pg.copy_to_csv: stream the statement as CSV with a header line."""
+    buf = io.StringIO(); w = csv.writer(buf)
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=500).execute(stmt)
+        w.writerow(result.keys())
+        for part in result.partitions():
+            for row in part:
+                w.writerow([_csv_cell(v) for v in row])
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0); buf.truncate()
+    if buf.tell(): yield buf.getvalue().encode("utf-8")
+
+def _load_csv(table: Table, fileobj, archives: List[Table]) -> int:
+    reader = csv.DictReader(io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline=""))
+    n = 0; batch: List[Dict[str, Any]] = []
+    with engine.begin() as conn:
+        for row in reader:
+            batch.append({k: _csv_value(table.c[k], v) for k, v in row.items()})
+            if len(batch) >= 1000:
+                conn.execute(insert(table), batch); n += len(batch); batch = []
+        if batch:
+            conn.execute(insert(table), batch); n += len(batch)
+        if "id" in reader.fieldnames:  # an archived id would come back as a second record (rolled back)
+            for a in archives:
+                hit = conn.execute(sa_select(table.c.id).where(table.c.id.in_(sa_select(a.c.id))).limit(1)).scalar()
+                if hit is not None: raise ValueError(f"المعرّف {hit} موجود في الأرشيف {a.name}")
+    return n
+
+@app.get("/api/export/{name}.csv")
+def export_csv(name: str, year: Optional[int] = None, month: Optional[int] = None):
+    model = _csv_model(name)
+    start, end = month_bounds(year, month) if year and month else (None, None)
+    stmt = _range_select(model, start, end, CSV_ORDER[name])
+    body = pg.copy_to_csv(engine, stmt) if DIALECT == "postgres" else _iter_csv(stmt)
+    return StreamingResponse(
+        body, media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f"attachment; filename={name}{f'_{year}_{month:02d}' if year and month else ''}.csv"}
+    )
+
+@app.post("/api/import/{name}.csv")
+def import_csv(name: str, file: UploadFile = File(...)):
+    """Bulk load a CSV whose header uses the table's column names (same layout as /api/export/{name}.csv)."""
+    model = _csv_model(name)
+    table, archives = model.__table__, partitions(model)[:-1]
+    header = next(csv.reader([file.file.readline().decode("utf-8-sig")]), [])
+    unknown = [c for c in header if c not in table.c]
+    if not header or unknown:
+        raise HTTPException(400, f"أعمدة غير معروفة: {', '.join(unknown)}")
+    file.file.seek(0)
+    try:
+        if DIALECT == "postgres":
+            n = pg.copy_from_csv(engine, table.name, header, file.file, [a.name for a in archives])
+        else:
+            n = _load_csv(table, file.file, archives)
+    except Exception as e:
+        raise HTTPException(400, f"فشل الاستيراد: {str(e) or type(e).__name__}")
+    suggester.reset()  # rebuilt on the next /api/suggest call
+    res: Dict[str, Any] = {"table": table.name, "rows": n}
+    cat = next((c for c in CATEGORY_COLUMNS.values() if c[0] == table.name), None)
+    if cat:
+        with engine.begin() as conn:
+            _backfill_category_ids(conn, only=table.name)
+            res["unknown_category"] = conn.execute(
+                sa_select(func.count()).select_from(table).where(table.c[cat[2]].is_(None))).scalar()
+    return res
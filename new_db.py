@@ -15,7 +15,7 @@ PRAGMA synchronous=NORMAL;
 
 -- ================== ISSUE ==================
 CREATE TABLE issue (
-  id INTEGER PRIMARY KEY,
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
   item_name TEXT NOT NULL,
   model TEXT,
   serial TEXT,
@@ -27,11 +27,25 @@ CREATE TABLE issue (
   qualified_by TEXT,
   receiver TEXT
 );
+CREATE INDEX IF NOT EXISTS ix_issue_issue_date ON issue (issue_date);
+
+-- ================= CATEGORY (seeded by the app on startup) =================
+CREATE TABLE category (
+  id INTEGER PRIMARY KEY,
+  kind TEXT NOT NULL,              -- cab | ast | spa
+  name TEXT NOT NULL,
+  position INTEGER NOT NULL DEFAULT 0,
+  report_label TEXT,
+  report_position INTEGER,
+  CONSTRAINT uq_category_kind_name UNIQUE (kind, name)
+);
+CREATE INDEX IF NOT EXISTS ix_category_kind ON category (kind);
 
 -- ================= CABINET REHAB =================
 CREATE TABLE cabinetrehab (
-  id INTEGER PRIMARY KEY,
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
   cabinet_type TEXT NOT NULL,
+  cabinet_type_id INTEGER REFERENCES category (id),
   code TEXT,
   rehab_date DATE NOT NULL,
   qualified_by TEXT,
@@ -41,11 +55,15 @@ CREATE TABLE cabinetrehab (
   notes TEXT
 );
 CREATE INDEX IF NOT EXISTS ix_cabinetrehab_code ON cabinetrehab (code);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_cabinetrehab_code ON cabinetrehab (code) WHERE code IS NOT NULL;
+CREATE INDEX IF NOT EXISTS ix_cabinetrehab_cabinet_type_id_rehab_date ON cabinetrehab (cabinet_type_id, rehab_date);
+CREATE INDEX IF NOT EXISTS ix_cabinetrehab_rehab_date ON cabinetrehab (rehab_date);
 
 -- ================== ASSET REHAB ==================
 CREATE TABLE assetrehab (
-  id INTEGER PRIMARY KEY,
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
   asset_type TEXT NOT NULL,
+  asset_type_id INTEGER REFERENCES category (id),
   model TEXT,
   serial_or_code TEXT,
   quantity INTEGER NOT NULL DEFAULT 1,
@@ -63,12 +81,16 @@ CREATE TABLE assetrehab (
   rehab_date DATE         -- REQUIRED for reports
 );
 CREATE INDEX IF NOT EXISTS ix_assetrehab_serial ON assetrehab (serial_or_code);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_assetrehab_serial_or_code ON assetrehab (serial_or_code) WHERE serial_or_code IS NOT NULL;
 CREATE INDEX IF NOT EXISTS ix_assetrehab_rehab_date ON assetrehab (rehab_date);
+CREATE INDEX IF NOT EXISTS ix_assetrehab_asset_type_id_rehab_date ON assetrehab (asset_type_id, rehab_date);
+CREATE INDEX IF NOT EXISTS ix_assetrehab_effective_date ON assetrehab (COALESCE(rehab_date, supply_date));
 
 -- =============== SPARE PART REHAB ===============
 CREATE TABLE sparepartrehab (
-  id INTEGER PRIMARY KEY,
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
   part_category TEXT NOT NULL,
+  part_category_id INTEGER REFERENCES category (id),
   part_name TEXT,
   part_model TEXT,
   quantity INTEGER NOT NULL DEFAULT 1,
@@ -80,6 +102,29 @@ CREATE TABLE sparepartrehab (
   notes TEXT
 );
 CREATE INDEX IF NOT EXISTS ix_sparepartrehab_serial ON sparepartrehab (serial);
+CREATE INDEX IF NOT EXISTS ix_sparepartrehab_part_category_id_rehab_date ON sparepartrehab (part_category_id, rehab_date);
+CREATE INDEX IF NOT EXISTS ix_sparepartrehab_rehab_date ON sparepartrehab (rehab_date);
+
+-- ================= ARCHIVE REGISTRY (archived rows live in <table>_<year>) =================
+CREATE TABLE archiveyear (
+  id INTEGER PRIMARY KEY,
+  table_name TEXT NOT NULL,
+  year INTEGER NOT NULL,
+  rows INTEGER NOT NULL DEFAULT 0,
+  archived_at DATETIME NOT NULL,
+  CONSTRAINT uq_archiveyear_table_year UNIQUE (table_name, year)
+);
+
+-- ================= IDEMPOTENCY KEYS (POST replay) =================
+CREATE TABLE idempotencykey (
+  key TEXT PRIMARY KEY,
+  path TEXT NOT NULL,
+  status INTEGER NOT NULL DEFAULT 0,   -- 0 = in progress
+  content_type TEXT,
+  body BLOB,
+  created_at DATETIME NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_idempotencykey_created_at ON idempotencykey (created_at);
 
 VACUUM;
 """
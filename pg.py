@@ -0,0 +1,134 @@
+# pg.py — Postgres-only fast paths (used by main.py when DATABASE_URL is set)
+#
+#   pool settings  : PG_POOL_SIZE (5), PG_MAX_OVERFLOW (10), PG_POOL_RECYCLE seconds (1800), PG_POOL_TIMEOUT (30)
+#   CSV export     : COPY (<select>) TO STDOUT
+#   CSV bulk load  : COPY <table> (<cols>) FROM STDIN
+#   monthly reports: date_trunc('month', ...) expression indexes
+#
+#   DATABASE_URL=postgresql://localhost/maintenance_test python pg.py check
+import os, io, csv, tempfile
+from datetime import date
+from typing import Any, Dict, IO, Iterator, List, Optional, Sequence
+
+from sqlalchemy import func, cast, text
+from sqlalchemy.types import TIMESTAMP
+
+COPY_CHUNK = 256 * 1024
+
+# (index name, table, month expression, category id column or None)
+MONTH_INDEXES = [
+    ("ix_issue_issue_month",                 "issue",          "issue_date",                          None),
+    ("ix_cabinetrehab_rehab_month",          "cabinetrehab",   "rehab_date",                          "cabinet_type_id"),
+    ("ix_assetrehab_rehab_month",            "assetrehab",     "rehab_date",                          "asset_type_id"),
+    ("ix_assetrehab_effective_month",        "assetrehab",     "COALESCE(rehab_date, supply_date)",   "asset_type_id"),
+    ("ix_sparepartrehab_rehab_month",        "sparepartrehab", "rehab_date",                          "part_category_id"),
+]
+
+def _env_int(name: str, default: int) -> int:
+    try: return int(os.getenv(name, default))
+    except ValueError: return default
+
+def engine_kwargs() -> Dict[str, Any]:
+    return dict(
+        pool_pre_ping=True,
+        pool_size=_env_int("PG_POOL_SIZE", 5),
+        max_overflow=_env_int("PG_MAX_OVERFLOW", 10),
+        pool_recycle=_env_int("PG_POOL_RECYCLE", 1800),
+        pool_timeout=_env_int("PG_POOL_TIMEOUT", 30),
+        echo=False,
+    )
+
+def month_key(col):
+    """date_trunc('month', col::timestamp) — the exact expression the MONTH_INDEXES are built on."""
+    return func.date_trunc("month", cast(col, TIMESTAMP))
+
+def ensure_month_indexes(conn, table: str, on: Optional[str] = None):
+    """MONTH_INDEXES of `table`, built on `on` (default the table; archives <table>_<year> have its columns)."""
+    on = on or table
+    # ::timestamp keeps date_trunc IMMUTABLE (the timestamptz overload is only STABLE)
+    for name, base, expr, cat_col in MONTH_INDEXES:
+        if base != table: continue
+        cols = f"date_trunc('month', ({expr})::timestamp)" + (f", {cat_col}" if cat_col else "")
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name.replace(base, on, 1)} ON {on} ({cols})"))
+
+def _inline(engine, raw_cur, stmt) -> str:
+    """Render a SQLAlchemy statement with its parameters bound by psycopg2 (COPY can't take parameters)."""
+    compiled = stmt.compile(dialect=engine.dialect)
+    return raw_cur.mogrify(str(compiled), compiled.params).decode()
+
+def _iter_file(buf) -> Iterator[bytes]:
+    try:
+        while True:
+            chunk = buf.read(COPY_CHUNK)
+            if not chunk: break
+            yield chunk
+    finally:
+        buf.close()
+
+def copy_to_csv(engine, stmt) -> Iterator[bytes]:
+    """Run COPY (<stmt>) TO STDOUT WITH CSV HEADER now and return an iterator over the output.
+    The server writes straight into a spooled temp file; no rows are materialized in Python."""
+    buf = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor() as cur:
+            sql = _inline(engine, cur, stmt)
+            cur.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER true)", buf)
+        raw.commit()
+    except Exception:
+        buf.close(); raise
+    finally:
+        raw.close()
+    buf.seek(0)
+    return _iter_file(buf)
+
+def copy_from_csv(engine, table: str, columns: List[str], fileobj: IO[bytes], archives: Sequence[str] = ()) -> int:
+    """COPY <table> (<columns>) FROM STDIN (CSV with a header line) in one transaction. Returns rows loaded.
+    `archives`: the table's <table>_<year> archives; loaded ids must not exist there (ValueError)."""
+    cols = ", ".join(f'"{c}"' for c in columns)
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor() as cur:
+            cur.copy_expert(f"COPY {table} ({cols}) FROM STDIN WITH (FORMAT csv, HEADER true)", fileobj)
+            n = cur.rowcount
+            if "id" in columns:
+                for a in archives:
+                    cur.execute(f"SELECT {table}.id FROM {table} JOIN {a} ON {a}.id = {table}.id LIMIT 1")
+                    hit = cur.fetchone()
+                    if hit: raise ValueError(f"المعرّف {hit[0]} موجود في الأرشيف {a}")
+                # keep the serial ahead of every loaded and archived id; never move it backwards
+                cur.execute(f"SELECT pg_get_serial_sequence('{table}', 'id')")
+                seq = cur.fetchone()[0]
+                highest = ", ".join(f"(SELECT COALESCE(MAX(id), 0) FROM {t})" for t in [table, *archives])
+                cur.execute(f"SELECT setval('{seq}', GREATEST({highest}, (SELECT last_value FROM {seq})))")
+        raw.commit()
+    except Exception:
+        raw.rollback(); raise
+    finally:
+        raw.close()
+    return n
+
+if __name__ == "__main__":
+    # Round-trip check against a local Postgres: COPY FROM -> COPY TO -> month index usage.
+    import sys
+    from sqlalchemy import create_engine, MetaData, Table, Column, Integer, Date, select
+    url = (os.getenv("DATABASE_URL") or "").replace("postgres://", "postgresql://", 1)
+    if not url or (len(sys.argv) > 1 and sys.argv[1] != "check"):
+        raise SystemExit("usage: DATABASE_URL=postgresql://... python pg.py check")
+    eng = create_engine(url, **engine_kwargs())
+    md = MetaData()
+    t = Table("pg_check", md, Column("id", Integer, primary_key=True), Column("d", Date), Column("n", Integer))
+    md.drop_all(eng); md.create_all(eng)
+    try:
+        data = "id,d,n\n" + "".join(f"{i},2025-{i % 12 + 1:02d}-01,{i}\n" for i in range(1, 1001))
+        print("loaded:", copy_from_csv(eng, "pg_check", ["id", "d", "n"], io.BytesIO(data.encode())))
+        out = b"".join(copy_to_csv(eng, select(t).where(t.c.d >= date(2025, 3, 1), t.c.d < date(2025, 4, 1))))
+        print("exported rows:", len(list(csv.reader(io.StringIO(out.decode())))) - 1)
+        with eng.begin() as conn:
+            conn.execute(text("CREATE INDEX ix_pg_check_month ON pg_check (date_trunc('month', d::timestamp))"))
+            conn.execute(text("ANALYZE pg_check"))
+            plan = conn.execute(text("EXPLAIN SELECT count(*) FROM pg_check "
+                                     "WHERE date_trunc('month', d::timestamp) = '2025-03-01'")).fetchall()
+        print("\n".join(r[0] for r in plan))
+    finally:
+        md.drop_all(eng)
@@ -0,0 +1,164 @@
+# slowlog.py — slow-query ring buffer with query plans (SQLAlchemy engine hooks)
+#
+# Every statement slower than SLOW_QUERY_MS (default 200) is kept in a bounded ring buffer
+# (SLOW_QUERY_KEEP entries, default 200) with its parameters, the API route that ran it and the plan of
+# SELECTs: EXPLAIN QUERY PLAN on SQLite, EXPLAIN on Postgres (EXPLAIN ANALYZE of plain SELECTs with
+# SLOW_QUERY_ANALYZE=1; ANALYZE runs the query a second time, so it is off by default). On Postgres the
+# plan is taken inside a savepoint, so a failing EXPLAIN leaves the caller's transaction usable.
+# SLOW_QUERY_MS=0 logs every statement.
+#
+#   python slowlog.py check     # run the app's hot queries, print their plans, exit 1 on a full-table scan
+#
+# On Postgres run the check against realistic, ANALYZEd data: the planner rightly seq-scans tiny tables.
+import contextvars, os, re, threading, time
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+
+# "METHOD /path" of the request being served; set by the app's middleware, copied into worker threads
+route: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("slowlog_route", default=None)
+
+_SQLITE_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)$")   # no "USING ... INDEX": every row is read
+_PG_SCAN = re.compile(r"Seq Scan on (\w+)")
+_SUBQUERY = re.compile(r"^anon_\d+$")                   # SQLAlchemy subquery aliases, not tables
+_READ = re.compile(r"\s*(SELECT|WITH)\b", re.I)        # only reads are explained
+_SELECT = re.compile(r"\s*SELECT\b", re.I)            # ANALYZE executes: never a WITH (its CTEs may write)
+
+def _env_num(name: str, default: float) -> float:
+    try: return float(os.getenv(name, default))
+    except ValueError: return default
+
+def _short(v: Any, limit: int = 500) -> str:
+    s = repr(v)
+    return s if len(s) <= limit else s[:limit] + "…"
+
+def full_scans(plan: List[str], dialect: str) -> List[str]:
+    """Tables a plan reads in full (SQLite "SCAN t" without an index, Postgres "Seq Scan on t")."""
+    out = []
+    for line in plan:
+        m = _SQLITE_SCAN.match(line.strip()) if dialect == "sqlite" else _PG_SCAN.search(line)
+        if m and not _SUBQUERY.match(m.group(1)) and m.group(1) not in out:
+            out.append(m.group(1))
+    return out
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms: Optional[float] = None, keep: Optional[int] = None,
+                 analyze: Optional[bool] = None):
+        self.threshold_ms = threshold_ms if threshold_ms is not None else _env_num("SLOW_QUERY_MS", 200)
+        self.analyze = analyze if analyze is not None else os.getenv("SLOW_QUERY_ANALYZE") == "1"
+        self.entries: deque = deque(maxlen=int(keep if keep is not None else _env_num("SLOW_QUERY_KEEP", 200)))
+        self.logged = 0
+        self._lock = threading.Lock()
+
+    def install(self, engine):
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None: context._slowlog_t0 = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        t0 = getattr(context, "_slowlog_t0", None)
+        if t0 is None: return
+        ms = (time.perf_counter() - t0) * 1000
+        if ms < self.threshold_ms: return
+        dialect = conn.dialect.name
+        plan, error = [], None
+        if not executemany and _READ.match(statement):
+            try:
+                plan = self.explain(cursor.connection, dialect, statement, parameters)
+            except Exception as e:  # the plan is a nice-to-have; never fail the query over it
+                error = str(e)
+        entry = {
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "ms": round(ms, 2),
+            "route": route.get(),
+            "statement": statement,
+            "params": _short(parameters),
+            "rows": -1 if executemany else getattr(cursor, "rowcount", -1),
+            "plan": plan,
+            "full_scans": full_scans(plan, dialect),
+        }
+        if error: entry["plan_error"] = error
+        with self._lock:
+            self.entries.append(entry)
+            self.logged += 1
+
+    def explain(self, dbapi_conn, dialect: str, statement: str, parameters) -> List[str]:
+        """Plan lines for a statement, run on the connection that just executed it."""
+        if dialect == "sqlite":
+            prefix = "EXPLAIN QUERY PLAN "
+        else:
+            prefix = "EXPLAIN (ANALYZE, BUFFERS) " if self.analyze and _SELECT.match(statement) else "EXPLAIN "
+        # Postgres: a failed EXPLAIN would abort the caller's open transaction (InFailedSqlTransaction),
+        # so it runs inside a savepoint that is always rolled back (EXPLAIN has nothing to keep)
+        fence = dialect != "sqlite"
+        cur = dbapi_conn.cursor()
+        try:
+            if fence: cur.execute("SAVEPOINT slowlog_explain")
+            try:
+                cur.execute(prefix + statement, parameters)
+                rows = cur.fetchall()
+            finally:
+                if fence:
+                    cur.execute("ROLLBACK TO SAVEPOINT slowlog_explain")
+                    cur.execute("RELEASE SAVEPOINT slowlog_explain")
+        finally:
+            cur.close()
+        if dialect == "sqlite":
+            # (id, parent, notused, detail): indent children under their parent like the sqlite3 shell
+            depth: Dict[int, int] = {0: -1}
+            out = []
+            for id_, parent, _, detail in rows:
+                depth[id_] = depth.get(parent, -1) + 1
+                out.append("  " * depth[id_] + detail)
+            return out
+        return [r[0] for r in rows]
+
+    def snapshot(self, limit: int = 50) -> Dict[str, Any]:
+        with self._lock:
+            recent = list(self.entries)[-limit:][::-1] if limit > 0 else []
+        return {"threshold_ms": self.threshold_ms, "logged": self.logged, "kept": len(self.entries),
+                "capacity": self.entries.maxlen, "entries": recent}
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+def check(engine, queries: List[Tuple[str, Any]], log: SlowQueryLog) -> List[Tuple[str, List[str]]]:
+    """Run each (name, statement) with every statement logged; [(name, tables scanned in full)]."""
+    saved = log.threshold_ms
+    log.threshold_ms = 0
+    failures = []
+    try:
+        with engine.connect() as conn:
+            for name, stmt in queries:
+                log.clear()
+                token = route.set(name)
+                try:
+                    conn.execute(stmt).fetchall()
+                finally:
+                    route.reset(token)
+                entries = [e for e in log.entries if e["plan"] or e.get("plan_error")]
+                print(f"-- {name}")
+                for e in entries:
+                    print("\n".join("   " + line for line in e["plan"]) or f"   (no plan: {e.get('plan_error')})")
+                scans = sorted({t for e in entries for t in e["full_scans"]})
+                if scans: failures.append((name, scans))
+    finally:
+        log.threshold_ms = saved
+        log.clear()
+    return failures
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:] != ["check"]:
+        raise SystemExit("usage: python slowlog.py check   (uses DB_PATH / DATABASE_URL like the app)")
+    import main
+    failed = check(main.engine, main.hot_queries(), main.slow_queries)
+    for name, scans in failed:
+        print(f"FULL SCAN: {name}: {', '.join(scans)}")
+    print("ok" if not failed else f"{len(failed)} hot queries scan whole tables")
+    sys.exit(1 if failed else 0)
@@ -30,8 +30,22 @@ async function getJSON(url) {
   return r.json();
 }
 
-async function postForm(url, form) {
-  const r = await fetch(url, { method: "POST", body: form });
+const newKey = () => (crypto.randomUUID ? crypto.randomUUID()
+  : `${Date.now()}-${Math.random().toString(16).slice(2)}`);
+
+// Idempotency-Key: retries after a dropped connection replay the first result instead of inserting twice
+async function postForm(url, form, key = newKey()) {
+  let r;
+  for (let attempt = 0; ; attempt++) {
+    try {
+      r = await fetch(url, { method: "POST", body: form, headers: { "Idempotency-Key": key } });
+      if (r.status === 409 && attempt < 3) { await new Promise(res => setTimeout(res, 1000)); continue; }
+      break;
+    } catch (err) {
+      if (attempt >= 2) throw err;
+      await new Promise(res => setTimeout(res, 500 * (attempt + 1)));
+    }
+  }
   if (!r.ok) {
     let msg = `HTTP ${r.status}`;
     try { const j = await r.json(); if (j?.detail) msg = j.detail; } catch {}
@@ -300,6 +314,12 @@ function bindExcel() {
     const m = toInt(qs("#excel-sum-month")?.value || cur.m, cur.m);
     download(`${API}/api/export/monthly_summary.xlsx?year=${y}&month=${m}`);
   });
+  qs("#btn-excel-month-pack")?.addEventListener("click", () => {
+    const cur = now();
+    const y = toInt(qs("#excel-sum-year")?.value || cur.y, cur.y);
+    const m = toInt(qs("#excel-sum-month")?.value || cur.m, cur.m);
+    download(`${API}/api/export/month_pack.xlsx?year=${y}&month=${m}`);
+  });
   qs("#btn-excel-quarterly")?.addEventListener("click", () => {
     const cur = now();
     const y = toInt(qs("#excel-q-year")?.value || cur.y, cur.y);
@@ -390,6 +410,36 @@ function bindGlobalSearch() {
   input.addEventListener("keyup", (e) => { if (e.key === "Enter") go(); });
 }
 
+/* ---------------------------- Autocomplete ----------------------------- */
+// input name -> /api/suggest/{field}
+const SUGGEST_FIELDS = {
+  location: "location", prev_location: "location", current_location: "current_location",
+  receiver: "receiver", requester: "requester", qualified_by: "qualified_by",
+  inspector: "inspector", model: "model",
+};
+
+function bindSuggest() {
+  qsa("form input[name]").forEach((input, i) => {
+    const field = SUGGEST_FIELDS[input.name];
+    if (!field) return;
+    const list = document.createElement("datalist");
+    list.id = `suggest-${field}-${i}`;
+    input.after(list);
+    input.setAttribute("list", list.id);
+    input.setAttribute("autocomplete", "off");
+    let timer = null;
+    input.addEventListener("input", () => {
+      clearTimeout(timer);
+      timer = setTimeout(async () => {
+        try {
+          const rows = await getJSON(`${API}/api/suggest/${field}?prefix=${encodeURIComponent(input.value)}`);
+          list.replaceChildren(...rows.map(r => Object.assign(document.createElement("option"), { value: r.value })));
+        } catch {}
+      }, 120);
+    });
+  });
+}
+
 /* -------------------------------- Init --------------------------------- */
 document.addEventListener("DOMContentLoaded", () => {
   // Main tiles
@@ -411,6 +461,7 @@ document.addEventListener("DOMContentLoaded", () => {
   bindCab();
   bindAst();
   bindSpa();
+  bindSuggest();
 
   // Excel & Duplicates
   bindExcel();
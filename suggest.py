@@ -0,0 +1,95 @@
+# suggest.py — in-memory prefix index for autocomplete (locations, people, models)
+#
+# One PrefixIndex per field. Values are matched on a normalized key (case, spaces, Arabic letter
+# variants) so "احمد" finds "أحمد"; each key remembers how often each spelling was used and
+# suggests the most common one, ranked by total frequency.
+#
+# Every prefix keeps its own top-TOP_K keys, maintained on add(): counts only grow, so a key can
+# only enter or climb a list when it is the one being added. A query is a dict lookup + slice.
+import re, threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+TOP_K = 50
+
+_AR_MAP = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ة": "ه", "ى": "ي", "ؤ": "و", "ئ": "ي", "ـ": None})
+_AR_DIACRITICS = re.compile("[\u064B-\u0652]")  # tashkeel
+_SPACES = re.compile(r"\s+")
+
+def normalize(s: str) -> str:
+    s = _AR_DIACRITICS.sub("", s).translate(_AR_MAP)
+    return _SPACES.sub(" ", s).strip().casefold()
+
+class PrefixIndex:
+    def __init__(self):
+        self._top: Dict[str, List[str]] = {}             # normalized prefix -> keys, best first
+        self._spellings: Dict[str, Dict[str, int]] = {}  # key -> {original spelling: count}
+        self._totals: Dict[str, int] = {}
+        self._best: Dict[str, str] = {}                  # key -> most used spelling
+        self._lock = threading.Lock()
+
+    def _before(self, a: str, b: str) -> bool:
+        ta, tb = self._totals[a], self._totals[b]
+        return ta > tb or (ta == tb and a < b)
+
+    def add(self, value: Optional[str], count: int = 1):
+        if not value: return
+        value = _SPACES.sub(" ", value).strip()
+        key = normalize(value)
+        if not key: return
+        with self._lock:
+            sp = self._spellings.setdefault(key, {})
+            sp[value] = sp.get(value, 0) + count
+            if sp[value] > sp.get(self._best.get(key, value), 0) or key not in self._best:
+                self._best[key] = value
+            self._totals[key] = self._totals.get(key, 0) + count
+            for i in range(len(key) + 1):
+                top = self._top.setdefault(key[:i], [])
+                try:
+                    j = top.index(key)
+                except ValueError:
+                    if len(top) < TOP_K:
+                        top.append(key); j = len(top) - 1
+                    elif self._before(key, top[-1]):
+                        top[-1] = key; j = len(top) - 1
+                    else:
+                        continue
+                while j > 0 and self._before(top[j], top[j - 1]):
+                    top[j], top[j - 1] = top[j - 1], top[j]; j -= 1
+
+    def clear(self):
+        with self._lock:
+            self._top.clear(); self._spellings.clear(); self._totals.clear(); self._best.clear()
+
+    def query(self, prefix: str, limit: int = 10) -> List[Tuple[str, int]]:
+        """[(most used spelling, total count)] for keys starting with prefix, most frequent first."""
+        with self._lock:
+            top = self._top.get(normalize(prefix or ""), ())[:limit]
+            return [(self._best[k], self._totals[k]) for k in top]
+
+    def __len__(self) -> int:
+        return len(self._totals)
+
+class Suggester:
+    """Field name -> PrefixIndex, filled once from the DB and then incrementally on each write."""
+
+    def __init__(self, fields: Iterable[str]):
+        self.indexes: Dict[str, PrefixIndex] = {f: PrefixIndex() for f in fields}
+        self.ready = False
+        self._build_lock = threading.Lock()
+
+    def build(self, loader):
+        """loader() yields (field, value, count); runs once unless reset()."""
+        with self._build_lock:
+            if self.ready: return
+            for idx in self.indexes.values(): idx.clear()
+            for field, value, count in loader():
+                idx = self.indexes.get(field)
+                if idx is not None: idx.add(value, count)
+            self.ready = True
+
+    def reset(self):
+        self.ready = False
+
+    def add(self, field: str, value: Optional[str]):
+        idx = self.indexes.get(field)
+        if idx is not None and self.ready: idx.add(value)